@@ -0,0 +1,347 @@
+#!/bin/python3
+
+"""
+"Smart DCA backtest" - Smart Dollar Cost Averaging backtest
+Copyright (C) 2022-2023 Andrea Varesio <https://www.andreavaresio.com/>
+Source Code: <https://github.com/andrea-varesio/smart-dca-backtest>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import pandas
+
+import main as backtest
+
+stages = ['data_prep', 'dca', 'trial_loop', 'metrics', 'aggregation']
+aggregation_timers = [
+    'mapper', 'best_results', 'pareto_frontier', 'top_trials', 'trial_files', 'results'
+]
+
+def parse_arguments():
+    """
+    Parse arguments
+    """
+
+    arg = argparse.ArgumentParser(description='Smart DCA backtest benchmark')
+
+    arg.add_argument(
+        '-t', '--trials', help='trial counts [Default: 1000 10000]', nargs='+', type=int
+    )
+    arg.add_argument(
+        '-n', '--months', help='history lengths in months [Default: 240 1200]', nargs='+', type=int
+    )
+    arg.add_argument(
+        '--modes', help='trial paths: loop, batch [Default: batch]', nargs='+', type=str
+    )
+    arg.add_argument(
+        '-r', '--repeat', help='runs of each case, the fastest is kept [Default: 3]', type=int
+    )
+    arg.add_argument('-s', '--seed', help='seed of prices and trials [Default: 1]', type=int)
+    arg.add_argument(
+        '--save-trials', help='trials to save: none, top-K, all [Default: none]', type=str
+    )
+    arg.add_argument('-o', '--output', help='save results to a json file', type=str)
+    arg.add_argument('--baseline', help='compare results with a json baseline', type=str)
+    arg.add_argument(
+        '--tolerance', help='allowed slowdown before a regression [Default: 0.2]', type=float
+    )
+    arg.add_argument(
+        '--startup-budget',
+        help='allowed seconds to start and show the version [Default: 0.25]', type=float
+    )
+
+    return arg.parse_args()
+
+def gen_history(months, seed, mu=0.07, sigma=0.18):
+    """
+    Generate daily prices following a geometric brownian motion, indexed by business day
+
+    Parameters
+    ----------
+    int months: Length of the history in months
+    int seed: Seed of the generator
+    float mu: Yearly drift
+    float sigma: Yearly volatility
+    """
+
+    start = pandas.Timestamp('1900-01-01')
+    end = start + pandas.DateOffset(months=months) - pandas.Timedelta(days=1)
+    dates = pandas.bdate_range(start, end)
+
+    rng = numpy.random.default_rng(seed)
+    step = 1 / 252
+    returns = rng.normal((mu - sigma**2 / 2) * step, sigma * step**0.5, len(dates))
+    returns[0] = 0
+
+    return pandas.DataFrame({'Close': 100 * numpy.exp(numpy.cumsum(returns))}, index=dates)
+
+def get_startup_time(repeat):
+    """
+    Return the fastest time, in seconds, to start a new interpreter and show the version
+
+    Parameters
+    ----------
+    int repeat: Number of runs
+    """
+
+    main_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'main.py')
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, main_path, '--version'], check=True, stdout=subprocess.DEVNULL
+        )
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def run_case(history, trials, mode, seed, save_trials):
+    """
+    Run a full backtest on synthetic data and return its total time, the time of each stage, and its
+    counters
+
+    Parameters
+    ----------
+    pandas.DataFrame history: Daily synthetic prices
+    int trials: Number of trials
+    str mode: Trial path, loop or batch
+    int seed: Seed of the trials
+    str save_trials: Trials to save
+    """
+
+    config = backtest.BacktestConfig(
+        trials=trials, batch=mode == 'batch', seed=seed, save_trials=save_trials, quiet=True
+    )
+    backtest.instruments.reset()
+    backtest.trial_cache.clear()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        backtester = backtest.Backtester(config, output_dir)
+        with backtest.instruments.timer('data_prep'):
+            data = backtest.get_monthly_data(history)
+        backtester.load_data(data)
+        backtester.run(keep_rows=False)
+        total = time.perf_counter() - start
+
+    timers, counters = backtest.instruments.snapshot()
+    seconds = {name: timer[1] for name, timer in timers.items()}
+
+    times = {
+        'data_prep': seconds.get('data_prep', 0.0),
+        'dca': seconds.get('dca', 0.0),
+        'metrics': seconds.get('metrics', 0.0),
+        'aggregation': sum(seconds.get(name, 0.0) for name in aggregation_timers)
+    }
+    times['trial_loop'] = total - sum(times.values())
+
+    return total, {stage: times[stage] for stage in stages}, counters
+
+def get_peak_memory(history, trials, mode, seed, save_trials):
+    """
+    Return peak memory allocated by a full backtest, in bytes
+
+    Parameters
+    ----------
+    pandas.DataFrame history: Daily synthetic prices
+    int trials: Number of trials
+    str mode: Trial path, loop or batch
+    int seed: Seed of the trials
+    str save_trials: Trials to save
+    """
+
+    tracemalloc.start()
+    try:
+        run_case(history, trials, mode, seed, save_trials)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmarks(trial_ls, month_ls, modes, repeat, seed, save_trials):
+    """
+    Benchmark every combination of mode, history length and trial count, return results
+
+    Parameters
+    ----------
+    list trial_ls: Trial counts
+    list month_ls: History lengths in months
+    list modes: Trial paths, loop or batch
+    int repeat: Runs of each case, the fastest is kept
+    int seed: Seed of prices and trials
+    str save_trials: Trials to save
+    """
+
+    results = []
+
+    for months in month_ls:
+        history = gen_history(months, seed)
+
+        for mode in modes:
+            # compile the numba kernel, if any, before timing
+            run_case(history, 1, mode, seed, save_trials)
+
+            for trials in trial_ls:
+                total, times, counters = min(
+                    (run_case(history, trials, mode, seed, save_trials) for _ in range(repeat)),
+                    key=lambda run: run[0]
+                )
+
+                results.append({
+                    'mode': mode,
+                    'months': months,
+                    'trials': trials,
+                    'time': total,
+                    'trials_per_sec': trials / total,
+                    'stages': times,
+                    'files_opened': counters.get('files_opened', 0),
+                    'bytes_written': counters.get('bytes_written', 0),
+                    'peak_memory': get_peak_memory(history, trials, mode, seed, save_trials)
+                })
+
+                print_case(results[-1])
+
+    return results
+
+def print_case(result, baseline=None):
+    """
+    Print a benchmark result, with the change from its baseline if any
+
+    Parameters
+    ----------
+    dict result: Benchmark result
+    dict baseline: Baseline result of the same case
+    """
+
+    line = (
+        f'{result["mode"]:<6} {result["months"]:>7} {result["trials"]:>8} '
+        f'{result["trials_per_sec"]:>14.1f} {result["peak_memory"] / 2**20:>10.1f}  '
+        + ' '.join(f'{stage}={result["stages"][stage]:.3f}s' for stage in stages)
+    )
+
+    if baseline:
+        change = result['trials_per_sec'] / baseline['trials_per_sec'] - 1
+        line += f'  [{change:+.1%}]'
+
+    print(line)
+
+def get_regressions(results, baseline, tolerance):
+    """
+    Compare results with a baseline and return the cases slower or larger than allowed
+
+    Parameters
+    ----------
+    list results: Benchmark results
+    dict baseline: Baseline benchmark file
+    float tolerance: Allowed relative slowdown and memory growth
+    """
+
+    cases = {(case['mode'], case['months'], case['trials']): case for case in baseline['results']}
+    regressions = []
+
+    for result in results:
+        case = cases.get((result['mode'], result['months'], result['trials']))
+
+        if case is None:
+            continue
+
+        if result['trials_per_sec'] < case['trials_per_sec'] * (1 - tolerance):
+            regressions.append((result, case, 'trials_per_sec'))
+
+        if result['peak_memory'] > case['peak_memory'] * (1 + tolerance):
+            regressions.append((result, case, 'peak_memory'))
+
+    return regressions
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+
+    modes = args.modes or ['batch']
+    for mode in modes:
+        if mode not in ('loop', 'batch'):
+            raise ValueError('Invalid mode! Use loop or batch')
+
+    seed = 1 if args.seed is None else args.seed
+    tolerance = 0.2 if args.tolerance is None else args.tolerance
+    startup_budget = 0.25 if args.startup_budget is None else args.startup_budget
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    startup = get_startup_time(args.repeat or 3)
+    print(f'Startup: {startup:.3f}s (budget {startup_budget:.3f}s)\n')
+
+    print(
+        f'{"<mode>":<6} {"<months>":>7} {"<trials>":>8} {"<trials/sec>":>14} {"<peak MiB>":>10}'
+        '  <stages>'
+    )
+
+    results = run_benchmarks(
+        args.trials or [1000, 10000], args.months or [240, 1200], modes,
+        args.repeat or 3, seed, args.save_trials or 'none'
+    )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump({
+                'version': backtest.VERSION,
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'numpy': numpy.__version__,
+                'pandas': pandas.__version__,
+                'numba': backtest.has_numba,
+                'seed': seed,
+                'startup': startup,
+                'results': results
+            }, output, indent=2)
+
+    regressions = []
+
+    if baseline:
+        regressions = get_regressions(results, baseline, tolerance)
+
+        print('\n' + '-' * 75)
+        for result, case, metric in regressions:
+            print(f'Regression in {metric}:')
+            print_case(result, case)
+
+        if not regressions:
+            print('No regressions')
+
+    if startup > startup_budget:
+        print(f'\nStartup over budget: {startup:.3f}s > {startup_budget:.3f}s')
+
+    if regressions or startup > startup_budget:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -20,20 +20,34 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import argparse
-import asyncio
+import ast
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
 import csv
+import dataclasses
 import datetime
 import hashlib
+import heapq
+import http.server
+import importlib.util
+import itertools
+import json
+import multiprocessing
 import os
 import pathlib
+import pickle
 import random
+import shutil
 import sys
+import tempfile
+import threading
 import time
+import urllib.parse
 import urllib.request
 
-import pandas
-import yfinance
-
 VERSION = 20230103.01
 
 cwd = os.path.dirname(os.path.realpath(__file__))
@@ -42,6 +56,41 @@ header = [
     'Trial', 'Value', 'Inv Total', 'Gain', 'All-time-high Drawdown', 'Max Drawdown',
     'Time to Recovery',' Ranges', 'Multipliers'
 ]
+metric_names = [
+    'XIRR', 'CAGR', 'Volatility', 'Sharpe', 'Sortino', 'Calmar', 'Ulcer Index', 'Avg Deployed'
+]
+result_fields = [
+    ('trial', '<i8'), ('value', '<f8'), ('inv_total', '<f8'), ('gain', '<f8'), ('ath_dd', '<f8'),
+    ('max_dd', '<f8'), ('ttr', '<i8'), ('ranges', '<f8', (7, 2)), ('multipliers', '<f8', (7,)),
+    ('ints', '<u4')
+]
+indices = {
+    'sp500': '^GSPC', 'dji': '^DJI', 'nasdaq': '^IXIC', 'nyse': '^NYA',
+    'r2000': '^RUT', 'ftse100': '^FTSE', 'n225': '^N225', 'ftsemib': 'FTSEMIB.MI'
+}
+batch_size = 1000
+stress_elements = 2**22
+xirr_iterations = 50
+checkpoint_interval = 60
+trial_cache_size = 100000
+service_progress = None
+service_history = 1000
+service_excluded = [
+    'assets', 'shard', 'output', 'workers', 'quiet', 'source', 'offline', 'save_historical'
+]
+setting_choices = {'stress_model': ['bootstrap', 'gbm'], 'results': ['csv', 'binary']}
+fixture_start = '1970-01-01'
+fixture_end = '2022-12-30'
+worker_config = None
+worker_data = None
+fetch_workers = 4
+download_interval = 0.5
+download_retries = 4
+download_lock = threading.Lock()
+download_time = 0
+has_numba = importlib.util.find_spec('numba') is not None
+prange = range
+simulate_trials_jit = None
 
 def parse_arguments():
     """
@@ -69,8 +118,17 @@ def parse_arguments():
     asset.add_argument('--ftse100', help='FTSE 100 (avail: 1984) [^FTSE]', action='store_true')
     asset.add_argument('--n225', help='Nikkei 225 (avail: 1965) [^N225]', action='store_true')
     asset.add_argument('--ftsemib', help='FTSE MIB (avail: 1997) [FTSEMIB.MI]', action='store_true')
+    asset.add_argument('--assets', help='list of assets to analyze', nargs='+', type=str)
+    asset.add_argument('--all-indices', help='analyze all built-in indices', action='store_true')
 
     arg.add_argument('-p', '--period', help='years to backtest [Default: ALL]', type=int)
+    arg.add_argument('--offline', help='use cached historical data only', action='store_true')
+    arg.add_argument(
+        '--source',
+        help='historical data: yfinance, fixture, or a csv/parquet file [Default: yfinance]',
+        type=str
+    )
+    arg.add_argument('--save-historical', help='save historical data to csv', action='store_true')
 
     arg.add_argument('-M', '--max-mult', help='maximum multiplier [Default: 2]', type=float)
     arg.add_argument('-m', '--min-mult', help='minimum multiplier [Default: 0.25]', type=float)
@@ -82,13 +140,449 @@ def parse_arguments():
     arg.add_argument('-fn', '--force-neg', help='force values < 0 for ranges', action='store_true')
     ranges.add_argument('-t', '--trials', help='random ranges trials [Default: 10000]', type=int)
     ranges.add_argument('-ir', '--incr-ranges', help='use incremental ranges', action='store_true')
+    ranges.add_argument(
+        '-g', '--grid', help='sweep ranges and multipliers from a json grid file', type=str
+    )
+    ranges.add_argument('--optimize', help='optimize ranges with a budget of evaluations', type=int)
+    arg.add_argument(
+        '--objective', help='objective to optimize, e.g. gain=1,max_dd=2 [Default: value]', type=str
+    )
+    arg.add_argument(
+        '-b', '--batch', help='run all trials in one vectorized pass', action='store_true'
+    )
+    arg.add_argument('-w', '--workers', help='number of worker processes [Default: 1]', type=int)
+    arg.add_argument('-s', '--seed', help='base seed for random ranges and multipliers', type=int)
+    arg.add_argument(
+        '--save-trials', help='trials to save: none, top-K, all [Default: all]', type=str
+    )
+    arg.add_argument(
+        '--cache-size',
+        help='trial results to keep in memory, 0 to disable [Default: 100000]', type=int
+    )
+    arg.add_argument(
+        '--persist-cache',
+        help='keep trial results on disk for later runs on the same prices', action='store_true'
+    )
+    arg.add_argument(
+        '--patience', help='stop after a number of trials without improving best results', type=int
+    )
+    arg.add_argument(
+        '--min-delta',
+        help='smallest change, in percent, counted as an improvement [Default: 0]', type=float
+    )
+    arg.add_argument('--shard', help='run only shard i of N of the trials, e.g. 2/4', type=str)
+    arg.add_argument(
+        '--walk-forward',
+        help='evaluate dca and best trials from every start month', action='store_true'
+    )
+    arg.add_argument(
+        '--horizon', help='months invested from each start month [Default: until today]', type=int
+    )
+    arg.add_argument(
+        '--extended-metrics',
+        help='save xirr, cagr, volatility, risk ratios and more for every trial',
+        action='store_true'
+    )
+    arg.add_argument(
+        '--risk-free',
+        help='yearly risk-free rate for sharpe and sortino ratios [Default: 0]', type=float
+    )
+    arg.add_argument(
+        '--stress',
+        help='evaluate dca and best trials on a number of simulated price paths', type=int
+    )
+    arg.add_argument(
+        '--stress-model',
+        help='price paths model [Default: bootstrap]', choices=setting_choices['stress_model']
+    )
+    arg.add_argument(
+        '--block-size', help='months in each bootstrapped block [Default: 12]', type=int
+    )
 
     arg.add_argument('-O', '--output', help='path to output directory', type=str)
+    arg.add_argument(
+        '--results',
+        help='format of the results of every trial [Default: csv]',
+        choices=setting_choices['results']
+    )
+    arg.add_argument(
+        '--resume', help='resume an interrupted run from its output directory', type=str
+    )
     arg.add_argument('-q', '--quiet', help='disable verbosity', action='store_true')
     arg.add_argument('-T', '--time', help='measure script execution time', action='store_true')
+    arg.add_argument(
+        '--metrics',
+        help='save stage timers and counters to json, or prometheus text for .prom', type=str
+    )
+    arg.add_argument('--profile', help='run under cProfile and save pstats to file', type=str)
+
+    commands = arg.add_subparsers(dest='command')
+    merge = commands.add_parser('merge', help='merge the results of sharded runs')
+    merge.add_argument('output', help='output directory of the merged results', type=str)
+    merge.add_argument(
+        'shards', help='output directories of the shards, in order', nargs='+', type=str
+    )
+    export = commands.add_parser('export', help='export binary results to csv or parquet')
+    export.add_argument('output', help='output directory with results.bin', type=str)
+    export.add_argument('path', help='exported file, parquet if it ends with .parquet', type=str)
+    serve = commands.add_parser('serve', help='run backtest jobs sent to a local http json service')
+    serve.add_argument(
+        '--host', help='address to listen on [Default: 127.0.0.1]', type=str, default='127.0.0.1'
+    )
+    serve.add_argument('--port', help='port to listen on [Default: 8421]', type=int, default=8421)
+    serve.add_argument(
+        '--jobs', help='jobs to run at the same time [Default: 1]', type=int, default=1
+    )
+    serve.add_argument(
+        '--queue',
+        help='jobs waiting to run before new ones are refused [Default: 100]', type=int, default=100
+    )
 
     return arg.parse_args()
 
+@dataclasses.dataclass
+class BacktestConfig:
+    """
+    Backtest settings, with the same names and defaults as the command line arguments
+    """
+
+    asset: str = 'SWDA.MI'
+    assets: list = None
+    period: int = None
+    offline: bool = False
+    source: str = None
+    save_historical: bool = False
+    max_mult: float = None
+    min_mult: float = None
+    force_max: bool = False
+    force_min: bool = False
+    mult_incr: float = None
+    rand_mult: bool = False
+    force_neg: bool = False
+    trials: int = None
+    incr_ranges: bool = False
+    grid: str = None
+    optimize: int = None
+    objective: str = None
+    batch: bool = False
+    workers: int = None
+    seed: int = None
+    save_trials: str = None
+    cache_size: int = None
+    persist_cache: bool = False
+    patience: int = None
+    min_delta: float = None
+    shard: str = None
+    walk_forward: bool = False
+    horizon: int = None
+    extended_metrics: bool = False
+    risk_free: float = None
+    stress: int = None
+    stress_model: str = None
+    block_size: int = None
+    results: str = None
+    output: str = None
+    quiet: bool = False
+
+def get_config(args):
+    """
+    Return backtest settings from parsed arguments
+
+    Parameters
+    ----------
+    argparse.Namespace args: Parsed arguments
+    """
+
+    fields = {field.name: getattr(args, field.name) for field in dataclasses.fields(BacktestConfig)}
+    fields.update(asset=get_asset(args), assets=get_assets(args))
+
+    return BacktestConfig(**fields)
+
+class Instruments:
+    """
+    Named timers and counters of the stages and output files of a run
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Time the code run inside the context
+
+        Parameters
+        ----------
+        str name: Timer name
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                calls, seconds = self.timers.get(name, (0, 0.0))
+                self.timers[name] = (calls + 1, seconds + elapsed)
+
+    def count(self, name, value=1):
+        """
+        Increase a counter
+
+        Parameters
+        ----------
+        str name: Counter name
+        int value: Increment
+        """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        """
+        Clear all timers and counters
+        """
+
+        with self.lock:
+            self.timers, self.counters = {}, {}
+
+    def snapshot(self):
+        """
+        Return a copy of timers and counters
+        """
+
+        with self.lock:
+            return dict(self.timers), dict(self.counters)
+
+    def merge(self, snapshot):
+        """
+        Add timers and counters from a snapshot, e.g. taken in a worker process
+
+        Parameters
+        ----------
+        tuple snapshot: Timers and counters returned by snapshot
+        """
+
+        timers, counters = snapshot
+
+        with self.lock:
+            for name, (calls, seconds) in timers.items():
+                total_calls, total_seconds = self.timers.get(name, (0, 0.0))
+                self.timers[name] = (total_calls + calls, total_seconds + seconds)
+
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_trials_per_sec(self):
+        """
+        Return trials run per second of trial loop wall time, None before any trial
+        """
+
+        seconds = self.timers.get('trial_loop', (0, 0.0))[1]
+
+        if not seconds:
+            return None
+
+        return self.counters.get('trials', 0) / seconds
+
+    def to_json(self):
+        """
+        Return timers and counters as a json string
+        """
+
+        timers, counters = self.snapshot()
+
+        return json.dumps({
+            'timers': {
+                name: {'calls': calls, 'seconds': seconds}
+                for name, (calls, seconds) in timers.items()
+            },
+            'counters': counters,
+            'trials_per_sec': self.get_trials_per_sec()
+        }, indent=2)
+
+    def to_prometheus(self):
+        """
+        Return timers and counters in prometheus text format
+        """
+
+        timers, counters = self.snapshot()
+        lines = [
+            '# HELP smart_dca_stage_seconds_total Time spent in each stage',
+            '# TYPE smart_dca_stage_seconds_total counter',
+            *(
+                f'smart_dca_stage_seconds_total{{stage="{name}"}} {seconds}'
+                for name, (_, seconds) in timers.items()
+            ),
+            '# HELP smart_dca_stage_calls_total Calls of each stage',
+            '# TYPE smart_dca_stage_calls_total counter',
+            *(
+                f'smart_dca_stage_calls_total{{stage="{name}"}} {calls}'
+                for name, (calls, _) in timers.items()
+            )
+        ]
+
+        for name, value in counters.items():
+            lines.append(f'# TYPE smart_dca_{name}_total counter')
+            lines.append(f'smart_dca_{name}_total {value}')
+
+        if self.get_trials_per_sec() is not None:
+            lines.append('# TYPE smart_dca_trials_per_second gauge')
+            lines.append(f'smart_dca_trials_per_second {self.get_trials_per_sec()}')
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """
+        Save timers and counters, in prometheus text format for .prom files and as json otherwise
+
+        Parameters
+        ----------
+        str path: Output file
+        """
+
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+    def print_stages(self):
+        """
+        Print time and calls of each stage, slowest first
+        """
+
+        timers, counters = self.snapshot()
+
+        print(f'{"<stage>":<20} {"<seconds>":>12} {"<calls>":>10}')
+        for name, (calls, seconds) in sorted(timers.items(), key=lambda timer: -timer[1][1]):
+            print(f'{name:<20} {seconds:>12.3f} {calls:>10}')
+
+        for name, value in counters.items():
+            print(f'{name + ":":<20} {value:>12}')
+
+        if self.get_trials_per_sec() is not None:
+            print(f'{"trials/sec:":<20} {self.get_trials_per_sec():>12.1f}')
+
+instruments = Instruments()
+
+class TrialCache:
+    """
+    Bounded LRU cache of trial results, keyed on the canonical tiers of each trial, for the price
+    series of a run, optionally kept on disk across runs
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.size, self.fingerprint, self.path = 0, None, None
+
+    def setup(self, config, data):
+        """
+        Prepare the cache for a run, loading results saved by previous runs on the same prices if
+        requested
+
+        Parameters
+        ----------
+        BacktestConfig config: Backtest settings
+        pandas.DataFrame data: Historical data for selected asset
+        """
+
+        import numpy
+
+        closes = numpy.ascontiguousarray(data['Close'].to_numpy(dtype=float))
+        fingerprint = hashlib.sha256(closes.tobytes()).hexdigest()[:16]
+        path = get_trial_cache_path(fingerprint) if config.persist_cache else None
+
+        if (fingerprint, path) != (self.fingerprint, self.path):
+            self.entries = collections.OrderedDict()
+
+            if path and os.path.isfile(path):
+                with open(path, 'rb') as cache_file:
+                    self.entries = pickle.load(cache_file)
+
+        self.size = trial_cache_size if config.cache_size is None else config.cache_size
+        self.fingerprint, self.path = fingerprint, path
+        self.trim()
+
+    def clear(self):
+        """
+        Drop all cached results, e.g. to time runs from a cold cache
+        """
+
+        self.entries = collections.OrderedDict()
+
+    def trim(self):
+        """
+        Drop the least recently used results above the size of the cache
+        """
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the cached results of a trial, None if missing
+
+        Parameters
+        ----------
+        tuple key: Trial key, as returned by get_trial_key
+        """
+
+        results = self.entries.get(key)
+
+        if results is not None:
+            self.entries.move_to_end(key)
+
+        return results
+
+    def put(self, key, results):
+        """
+        Cache the results of a trial
+
+        Parameters
+        ----------
+        tuple key: Trial key, as returned by get_trial_key
+        tuple results: Value, total invested amount, gain, drawdowns and time to recovery
+        """
+
+        self.entries[key] = results
+        self.entries.move_to_end(key)
+        self.trim()
+
+    def save(self):
+        """
+        Save the cache to disk, if requested by the run
+        """
+
+        if not self.path:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open_output(f'{self.path}.tmp', 'wb') as cache_file:
+            pickle.dump(self.entries, cache_file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+trial_cache = TrialCache()
+
+@contextlib.contextmanager
+def open_output(path, mode='w'):
+    """
+    Open an output file, counting files opened and bytes written
+
+    Parameters
+    ----------
+    str path: Output file
+    str mode: File mode, w, a, or wb
+    """
+
+    encoding = None if 'b' in mode else 'utf-8'
+
+    with open(path, mode, encoding=encoding) as output:
+        start = output.tell()
+        yield output
+        instruments.count('bytes_written', output.tell() - start)
+
+    instruments.count('files_opened')
+
 def show_license():
     """
     Print license
@@ -112,9 +606,13 @@ def show_disclaimer():
     print(f"{pathlib.Path(os.path.join(cwd, 'DISCLAIMER')).read_text(encoding='utf-8')}")
     print('*' * 100)
 
-def run_update():
+def run_update(quiet=False):
     """
     Check for new online versions, prompt to update, and verify hash before proceeding
+
+    Parameters
+    ----------
+    bool quiet: Disable verbosity
     """
 
     baseurl = 'https://raw.githubusercontent.com/andrea-varesio/smart-dca-backtest/main/'
@@ -148,16 +646,18 @@ def run_update():
         else:
             raise ValueError('sha512sum does not match!')
 
-    args = parse_arguments()
-    if not args.quiet:
+    if not quiet:
         print('Update complete')
 
-def run_checks():
+def run_checks(args):
     """
     Run required checks for correct program functionality
+
+    Parameters
+    ----------
+    argparse.Namespace args: Parsed arguments
     """
 
-    args = parse_arguments()
     status = 0
 
     if args.license:
@@ -173,37 +673,36 @@ def run_checks():
         status += 1
 
     if args.update:
-        run_update()
+        run_update(args.quiet)
         status += 1
 
     if status > 0:
         sys.exit(0)
 
-def get_output_dir(asset):
+def get_output_dir(config, asset):
     """
     Define output directory
 
     Parameters
     ----------
+    BacktestConfig config: Backtest settings
     str asset: Asset to analyze
     """
 
-    args = parse_arguments()
-
     dir_main = 'smart-dca-backtest'
     dir_sub = f'{asset}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}'
     dir_path = os.path.join(dir_main, dir_sub)
 
-    if not args.output:
+    if not config.output:
         return os.path.join(pathlib.Path.home(), dir_path)
 
-    if os.path.isdir(args.output):
-        if args.output.startswith('./'):
-            output_dir_root = os.path.join(os.getcwd(), args.output.replace('./', '', 1))
-        elif args.output == '.':
-            output_dir_root = args.output.replace('.', os.getcwd())
+    if os.path.isdir(config.output):
+        if config.output.startswith('./'):
+            output_dir_root = os.path.join(os.getcwd(), config.output.replace('./', '', 1))
+        elif config.output == '.':
+            output_dir_root = config.output.replace('.', os.getcwd())
         else:
-            output_dir_root = args.output
+            output_dir_root = config.output
 
         return os.path.join(output_dir_root, dir_path)
 
@@ -224,566 +723,3603 @@ def get_trial_path(output_dir, trial):
 
     return os.path.join(output_dir, 'trials', f'trial_{trial}.csv')
 
-def get_asset():
+def get_asset(args):
     """
     Define asset to analyze
-    """
 
-    args = parse_arguments()
+    Parameters
+    ----------
+    argparse.Namespace args: Parsed arguments
+    """
 
     if args.asset:
-        asset = args.asset
-    elif args.sp500:
-        asset = '^GSPC'
-    elif args.dji:
-        asset = '^DJI'
-    elif args.nasdaq:
-        asset = '^IXIC'
-    elif args.nyse:
-        asset = '^NYA'
-    elif args.r2000:
-        asset = '^RUT'
-    elif args.ftse100:
-        asset = '^FTSE'
-    elif args.n225:
-        asset = '^N225'
-    elif args.ftsemib:
-        asset = 'FTSEMIB.MI'
-    else:
-        asset = 'SWDA.MI'
+        return args.asset
+
+    for name, asset in indices.items():
+        if getattr(args, name):
+            return asset
 
-    return asset
+    return 'SWDA.MI'
 
-def get_period():
+def get_assets(args):
     """
-    Define time period to analyze
+    Define assets to analyze in a multi-asset run, None for a single asset
+
+    Parameters
+    ----------
+    argparse.Namespace args: Parsed arguments
     """
 
-    args = parse_arguments()
+    if args.assets:
+        return list(dict.fromkeys(args.assets))
 
-    if not args.period:
-        return int(datetime.datetime.now().strftime('%Y')) - 999
+    if args.all_indices:
+        return list(indices.values())
 
-    return int(datetime.datetime.now().strftime('%Y')) - args.period
+    return None
 
-def get_data(asset, output_dir):
+def get_period(config):
     """
-    Get historical data and save it to historical.csv, return start_date and data
+    Define time period to analyze
 
     Parameters
     ----------
-    str asset: Asset to analyze
-    str output_dir: Output directory
+    BacktestConfig config: Backtest settings
     """
 
-    date = datetime.datetime.now().strftime('%Y-%m-%d')
-    hist_raw = os.path.join(output_dir, 'historical_raw.csv')
-    hist = os.path.join(output_dir, 'historical.csv')
+    if not config.period:
+        return int(datetime.datetime.now().strftime('%Y')) - 999
 
-    data_raw_yf = yfinance.download(asset, f'{get_period()}-01-01', date, progress=False)
-    data_raw_yf.to_csv(hist_raw)
+    return int(datetime.datetime.now().strftime('%Y')) - config.period
 
-    tz_format = '%Y-%m-%d %H:%M:%S%z'
-    start_date = datetime.datetime.strptime(pandas.read_csv(hist_raw)['Date'][0], tz_format).date()
+def get_cache_path(asset):
+    """
+    Return path of the cached historical data for the asset
 
-    with (
-        open(hist_raw, 'r', encoding='utf-8') as data_raw,
-        open(hist, 'w', encoding='utf-8') as data_clean
-    ):
+    Parameters
+    ----------
+    str asset: Asset to analyze
+    """
 
-        csv_data = csv.writer(data_clean,delimiter=',')
-        csv_data.writerow(['Date', 'Close'])
+    cache_root = os.environ.get('XDG_CACHE_HOME', os.path.join(pathlib.Path.home(), '.cache'))
+    cache_name = hashlib.sha256(asset.encode()).hexdigest()[:16]
 
-        current_month = None
+    return os.path.join(cache_root, 'smart-dca-backtest', f'{cache_name}.pkl')
 
-        for line in csv.reader(data_raw):
-            try:
-                date = datetime.datetime.strptime(line[0][:19], "%Y-%m-%d %H:%M:%S")
+def get_trial_cache_path(fingerprint):
+    """
+    Return path of the cached trial results for a price series
 
-                if date.month != current_month:
-                    current_month = date.month
-                    csv_data.writerow([line[0], line[4]])
-            except ValueError:
-                pass
+    Parameters
+    ----------
+    str fingerprint: Hash of the monthly close prices
+    """
+
+    cache_root = os.environ.get('XDG_CACHE_HOME', os.path.join(pathlib.Path.home(), '.cache'))
 
-    return start_date, pandas.read_csv(hist)
+    return os.path.join(cache_root, 'smart-dca-backtest', f'trials-{fingerprint}.pkl')
 
-def gen_multipliers():
+def get_yfinance():
     """
-    Generate list of multipliers
+    Import yfinance on first use, it is slow to import and only needed to download data
     """
 
-    args = parse_arguments()
+    import yfinance
 
-    if args.max_mult:
-        maxm = args.max_mult
-    else:
-        maxm = 2
+    return yfinance
 
-    if args.min_mult:
-        minm = args.min_mult
-    else:
-        minm = 0.25
+def get_download_errors():
+    """
+    Return the errors of a download that are worth retrying, only recent versions of yfinance have
+    their own exceptions, such as the one of rate limited requests
+    """
 
-    if args.rand_mult:
-        if not args.force_max:
-            maxm = round(random.uniform(1, maxm), 2)
+    errors = (OSError, ValueError, KeyError)
 
-        if not args.force_min:
-            minm = round(random.uniform(minm, 1), 2)
+    try:
+        from yfinance.exceptions import YFException
+    except ImportError:
+        return errors
 
-        n2_mult = round(random.uniform(1, maxm), 2)
-        n1_mult = round(random.uniform(1, n2_mult), 2)
+    return (*errors, YFException)
 
-        p2_mult = round(random.uniform(1, minm), 2)
-        p1_mult = round(random.uniform(1, p2_mult), 2)
+def download_history(asset, start, end):
+    """
+    Download daily historical data, spacing out requests and retrying with backoff on errors
 
-        return dict(zip(tiers, [maxm, n2_mult, n1_mult, 1, p1_mult, p2_mult, minm]))
+    Parameters
+    ----------
+    str asset: Asset to analyze
+    str start: First day to download
+    str end: Day after the last day to download
+    """
 
-    if args.mult_incr:
-        incr = args.mult_incr
-    else:
-        incr = 0.25
+    global download_time
 
-    if not args.force_max and maxm > 1 + (incr * 3):
-        maxm = 1 + (incr * 3)
+    errors = get_download_errors()
 
-    if not args.force_min and minm < 1 - (incr * 3):
-        minm = 1 - (incr * 3)
+    for attempt in range(download_retries):
+        with download_lock:
+            time.sleep(max(0, download_time + download_interval - time.monotonic()))
+            download_time = time.monotonic()
 
-    return dict(zip(tiers, [maxm, 1+(incr*2), 1+incr, 1, 1-incr, 1-(incr*2), minm]))
+        try:
+            data = get_yfinance().Ticker(asset).history(
+                start=start, end=end, auto_adjust=False, actions=False
+            )
+
+            # yfinance reports failed downloads and unknown assets with an empty frame
+            if data.empty:
+                raise ValueError(f'No data downloaded for {asset}!')
+        except errors:
+            if attempt == download_retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+        else:
+            return data
+
+    raise ValueError(f'Could not download data for {asset}!')
 
-def get_multiplier(delta, multipliers, ranges):
+def get_history(config, asset):
     """
-    Define multiplier for single investment
+    Return daily historical data from yfinance, downloading only what is missing from the local
+    cache
 
     Parameters
     ----------
-    float delta: Percentage of difference between close price and average price paid
-    dict multipliers: List of defined multipliers
-    dict ranges: Trial ranges
+    BacktestConfig config: Backtest settings
+    str asset: Asset to analyze
     """
 
-    if delta < ranges['tier_n3'][1]:
-        multiplier = multipliers['tier_n3']
-    elif ranges['tier_n2'][0] <= delta < ranges['tier_n2'][1]:
-        multiplier = multipliers['tier_n2']
-    elif ranges['tier_n1'][0] <= delta < ranges['tier_n1'][1]:
-        multiplier = multipliers['tier_n1']
-    elif ranges['tier_00'][0] <= delta < ranges['tier_00'][1]:
-        multiplier = multipliers['tier_00']
-    elif ranges['tier_p1'][0] <= delta < ranges['tier_p1'][1]:
-        multiplier = multipliers['tier_p1']
-    elif ranges['tier_p2'][0] <= delta < ranges['tier_p2'][1]:
-        multiplier = multipliers['tier_p2']
-    elif ranges['tier_p3'][0] <= delta:
-        multiplier = multipliers['tier_p3']
+    date = datetime.datetime.now().strftime('%Y-%m-%d')
+    period = get_period(config)
+    cache_path = get_cache_path(asset)
+
+    cache = None
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as cache_file:
+            cache = pickle.load(cache_file)
+
+        if cache['asset'] != asset or cache['start'] > period:
+            cache = None
+
+    if config.offline and cache is None:
+        raise FileNotFoundError(f'No cached data for {asset}!')
+
+    if cache is None:
+        data = download_history(asset, f'{period}-01-01', date)
+        cache = {'asset': asset, 'start': period, 'updated': None, 'data': data}
+    elif not config.offline and cache['updated'] != date:
+        import pandas
 
-    return multiplier
+        last_date = cache['data'].index[-1].strftime('%Y-%m-%d')
+        data = pandas.concat([cache['data'], download_history(asset, last_date, date)])
+        cache['data'] = data[~data.index.duplicated(keep='last')].sort_index()
 
-def get_drawdown(trial_path):
+    if not config.offline and cache['updated'] != date:
+        cache['updated'] = date
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open_output(f'{cache_path}.tmp', 'wb') as cache_file:
+            pickle.dump(cache, cache_file)
+        os.replace(f'{cache_path}.tmp', cache_path)
+
+    return cache['data'][cache['data'].index.year >= period]
+
+def get_file_history(config, asset):
     """
-    Calculate monthly drawdowns and return max drawdown
+    Return daily historical data from a local csv or parquet file, indexed by date, using the column
+    named after the asset if any, Close otherwise
 
     Parameters
     ----------
-    str trial_path: Trial path
+    BacktestConfig config: Backtest settings
+    str asset: Asset to analyze
     """
 
-    msr = pandas.read_csv(trial_path)['Value'].pct_change()
-    wealth_index = 1000 * (1 + msr).cumprod()
-    prev_peaks = wealth_index.cummax()
-    drawdown = (wealth_index - prev_peaks) / prev_peaks
+    import pandas
 
-    trial_update = []
-    with open(trial_path, 'r', encoding='utf-8') as trial_file:
-        for line in csv.reader(trial_file):
-            trial_update.append(line)
+    if not os.path.isfile(config.source):
+        raise FileNotFoundError(f'{config.source} not found!')
 
-    i = 0
-    with open(trial_path, 'w', encoding='utf-8', newline='') as trial_file:
-        for line in trial_update:
-            try:
-                if i == 0:
-                    line.append('Drawdown')
-                else:
-                    line.append(drawdown[i+1] * 100)
-                csv.writer(trial_file).writerow(line)
-            except (KeyError, ValueError):
-                pass
-            i += 1
-
-    drawdowns, values = [], []
-
-    with open(trial_path, 'r', encoding='utf-8') as trial_file:
-        for line in csv.reader(trial_file):
-            try:
-                drawdowns.append(float(line[6]))
-                values.append(float(line[2]))
-            except ValueError:
-                pass
+    if config.source.endswith('.parquet'):
+        data = pandas.read_parquet(config.source)
+    else:
+        data = pandas.read_csv(config.source, index_col=0)
 
-    max_dd = min(drawdowns)
-    values = values[drawdowns.index(max_dd):]
+    if 'Date' in data.columns:
+        data = data.set_index('Date')
+    if not isinstance(data.index, pandas.DatetimeIndex):
+        data.index = pandas.to_datetime(data.index.astype(str).str[:10])
+    data.index = data.index.tz_localize(None)
 
-    ttr = 0
-    for value in values:
-        if ttr != 0 and value >= values[0]:
-            break
-        ttr += 1
+    column = asset if asset in data.columns else 'Close'
+    if column not in data.columns:
+        raise ValueError(f'{config.source} has no {asset} or Close column!')
 
-    return max_dd, ttr
+    data = data[[column]].rename(columns={column: 'Close'}).dropna().sort_index()
 
-def get_trial_data(output_dir, trial):
+    return data[data.index.year >= get_period(config)]
+
+def get_fixture_history(asset):
     """
-    Get last value, all-time-high drawdown, max drawdown, and time to recovery
+    Return synthetic daily historical data, a geometric brownian motion seeded by the asset name
+    over a fixed time span, to run without network or files
 
     Parameters
     ----------
-    str output_dir: Output directory
-    int trial: Trial number
+    str asset: Asset to analyze
     """
 
-    trial_path = get_trial_path(output_dir, trial)
+    import numpy
+    import pandas
 
-    with open(trial_path, 'rb') as trial_file:
-        try:
-            trial_file.seek(-2, os.SEEK_END)
-            while trial_file.read(1) != b'\n':
-                trial_file.seek(-2, os.SEEK_CUR)
-        except OSError:
-            trial_file.seek(0)
+    dates = pandas.bdate_range(fixture_start, fixture_end)
 
-        last_value = trial_file.readline().decode().split(',')[2]
+    rng = numpy.random.default_rng(int(hashlib.sha256(asset.encode()).hexdigest()[:8], 16))
+    returns = rng.normal((0.07 - 0.18**2 / 2) / 252, 0.18 / 252**0.5, len(dates))
+    returns[0] = 0
 
-    with open(trial_path, 'r', encoding='utf-8') as trial_file:
-        values = []
-        for line in csv.reader(trial_file):
-            try:
-                values.append(float(line[2]))
-            except ValueError:
-                pass
+    return pandas.DataFrame({'Close': 100 * numpy.exp(numpy.cumsum(returns))}, index=dates)
+
+def get_source_history(config, asset):
+    """
+    Return daily historical data from the selected source, importing only what that source needs
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str asset: Asset to analyze
+    """
 
-    values_ath = values[values.index(max(values)):]
-    ath_drawdown = 0 - (100 - (min(values_ath) * 100 / max(values_ath)))
+    if not config.source or config.source == 'yfinance':
+        return get_history(config, asset)
 
-    max_drawdown, ttr = get_drawdown(trial_path)
+    if config.source == 'fixture':
+        return get_fixture_history(asset)
 
-    return last_value, ath_drawdown, max_drawdown, ttr
+    return get_file_history(config, asset)
 
-def mapper(output_dir, trial, inv_total, ranges, mp_ls):
+def get_monthly_data(data_raw_yf):
     """
-    Append results to mapper file
+    Return the first close of every month from daily historical data
 
     Parameters
     ----------
-    str output_dir: Output directory
-    int trial: Trial number
-    float inv_total: Total invested amount
-    dict ranges: Trial ranges
-    dict mp_ls: List of defined multipliers
+    pandas.DataFrame data_raw_yf: Daily historical data, indexed by date
     """
 
-    mapper_path = os.path.join(output_dir, 'mapper.csv')
-
-    last_value, ath_dd, max_dd, ttr = get_trial_data(output_dir, trial)
+    import numpy
+    import pandas
 
-    if not os.path.exists(mapper_path):
-        with open(mapper_path, 'a', encoding='utf-8') as map_file:
-            csv_mapper = csv.writer(map_file,delimiter=',')
-            csv_mapper.writerow(header)
-
-    if isinstance(trial, int):
-        gain = (float(last_value) * 100 / inv_total) - 100
+    months = data_raw_yf.index.year * 12 + data_raw_yf.index.month
+    first_days = numpy.diff(months, prepend=-1) != 0
 
-    with open(mapper_path, 'a', encoding='utf-8') as map_file:
-        map_file = csv.writer(map_file,delimiter=',')
-        map_file.writerow([trial, last_value, inv_total, gain, ath_dd, max_dd, ttr, ranges, mp_ls])
+    return pandas.DataFrame({
+        'Date': data_raw_yf.index[first_days],
+        'Close': numpy.ascontiguousarray(data_raw_yf['Close'].to_numpy(dtype=float)[first_days])
+    })
 
-def run_dca_analysis(output_dir, data):
+def get_data(config, asset, output_dir):
     """
-    Run DCA analysis from input data
+    Get monthly historical data, optionally saving it to historical.csv, return start_date and data
 
     Parameters
     ----------
+    BacktestConfig config: Backtest settings
+    str asset: Asset to analyze
     str output_dir: Output directory
-    pandas.DataFrame data: Historical data for selected asset
     """
 
-    shares, inv_total, avg_nav = 0, 0, 0
-
-    with open(get_trial_path(output_dir, 0), 'w', encoding='utf-8') as results:
-        csv_res = csv.writer(results, delimiter=',')
-        csv_res.writerow(['Close', 'Shares', 'Value', 'Inv Monthly', 'Invested Tot', 'Avg NAV'])
+    with instruments.timer('download'):
+        data_raw_yf = get_source_history(config, asset)
 
-        for close in data['Close']:
-            inv_monthly = 100
-            inv_total += inv_monthly
-            shares += inv_monthly / close
-            avg_nav = inv_total / shares
-            value = shares * close
+    with instruments.timer('data_prep'):
+        data = get_monthly_data(data_raw_yf)
 
-            csv_res.writerow([close, shares, value, inv_monthly, inv_total, avg_nav])
+    if config.save_historical:
+        with open_output(os.path.join(output_dir, 'historical_raw.csv')) as output:
+            data_raw_yf.to_csv(output)
+        with open_output(os.path.join(output_dir, 'historical.csv')) as output:
+            data.to_csv(output, index=False)
 
-    mapper(output_dir, 0, inv_total, 0, 0)
+    return data_raw_yf.index[0].date(), data
 
-def generate_ranges_random():
-    """
-    Generate random ranges
+def gen_multipliers(config, rng=random):
     """
+    Generate list of multipliers
 
-    args = parse_arguments()
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    random.Random rng: Random number generator
+    """
 
-    ranges = {}
-    range_upper_old = None
+    if config.max_mult:
+        maxm = config.max_mult
+    else:
+        maxm = 2
 
-    if args.force_neg:
-        upper_limit_neg = 0
+    if config.min_mult:
+        minm = config.min_mult
     else:
-        upper_limit_neg = 15
+        minm = 0.25
 
-    for tier in tiers:
+    if config.rand_mult:
+        if not config.force_max:
+            maxm = round(rng.uniform(1, maxm), 2)
 
-        if tier[5] == 'n':
-            upper_limit = upper_limit_neg
-        else:
-            upper_limit = 15
+        if not config.force_min:
+            minm = round(rng.uniform(minm, 1), 2)
 
-        if range_upper_old is None:
-            range_lower = 9999
-            range_upper = round(random.uniform(-15, upper_limit), 1)
-            range_upper_old = range_upper
-        else:
-            range_lower = range_upper_old
-            range_upper = round(random.uniform(range_lower, upper_limit), 1)
-            range_upper_old = range_upper
+        n2_mult = round(rng.uniform(1, maxm), 2)
+        n1_mult = round(rng.uniform(1, n2_mult), 2)
 
-        if tier == 'tier_p3':
-            range_upper = 9999
+        p2_mult = round(rng.uniform(1, minm), 2)
+        p1_mult = round(rng.uniform(1, p2_mult), 2)
 
-        ranges[tier] = [range_lower, range_upper]
+        return dict(zip(tiers, [maxm, n2_mult, n1_mult, 1, p1_mult, p2_mult, minm]))
 
-    return ranges
+    if config.mult_incr:
+        incr = config.mult_incr
+    else:
+        incr = 0.25
 
-def generate_ranges_incremental(i):
+    if not config.force_max and maxm > 1 + (incr * 3):
+        maxm = 1 + (incr * 3)
+
+    if not config.force_min and minm < 1 - (incr * 3):
+        minm = 1 - (incr * 3)
+
+    return dict(zip(tiers, [maxm, 1+(incr*2), 1+incr, 1, 1-incr, 1-(incr*2), minm]))
+
+def compile_tiers(ranges, multipliers):
     """
-    Generate incremental ranges
+    Compile trial ranges and multipliers into sorted tier boundaries and multipliers
 
     Parameters
     ----------
-    float i: increment
+    dict ranges: Trial ranges
+    dict multipliers: List of defined multipliers
     """
 
-    ranges = {}
-
-    for tier in tiers:
-        if tier == 'tier_00':
-            range_lower = -i
-            range_upper = i
-        elif tier[6] == '1':
-            range_lower = i
-            range_upper = i + 2.5
-        elif tier[6] == '2':
-            range_lower = i + 2.5
-            range_upper = i + 5
-        elif tier[6] == '3':
-            range_lower = i + 5
-            range_upper = 9999
+    bounds = [ranges[tier][1] for tier in tiers[:-1]]
 
-        if tier[5] == 'n':
-            range_lower, range_upper = 0 - range_upper, 0 - range_lower
+    for tier, lower in zip(tiers[1:], bounds):
+        if ranges[tier][0] != lower:
+            raise ValueError(f'Invalid ranges! {tier} does not start where the previous tier ends')
 
-        ranges[tier] = [range_lower, range_upper]
+    for tier, lower, upper in zip(tiers[1:-1], bounds, bounds[1:]):
+        if upper < lower:
+            raise ValueError(f'Invalid ranges! {tier} ends before it starts')
 
-    return ranges
+    return bounds, [multipliers[tier] for tier in tiers]
 
-async def run_smart_dca_analysis(output_dir, trial, data, multipliers, ranges=None):
+def get_trial_key(ranges, multipliers, kernel):
     """
-    Run by-range smart dca analysis from input data
+    Return the canonical form of the tiers of a trial: empty tiers are dropped and adjacent tiers
+    with the same multiplier are merged, so that trials investing the same amounts for every price
+    share a key
 
     Parameters
     ----------
-    str output_dir: Output directory
-    int trial: Trian number
-    pandas.DataFrame data: Historical data for selected asset
-    dict multipliers: List of defined multipliers
     dict ranges: Trial ranges
+    dict multipliers: List of defined multipliers
+    str kernel: Simulation the results come from, their last digits can differ between simulations
     """
 
-    if not multipliers:
-        multipliers = gen_multipliers()
+    bounds, mults = compile_tiers(ranges, multipliers)
+    mults = [(mult, isinstance(mult, int)) for mult in mults]
+    key_bounds, key_mults = [], mults[:1]
 
-    if not ranges:
-        ranges = generate_ranges_random()
+    for bound, next_bound, mult in zip(bounds, bounds[1:] + [None], mults[1:]):
+        if bound != next_bound and mult != key_mults[-1]:
+            key_bounds.append(bound)
+            key_mults.append(mult)
 
-    with open(get_trial_path(output_dir, trial), 'w', encoding='utf-8') as res:
-        csv_res = csv.writer(res, delimiter=',')
-        csv_res.writerow(['Close', 'Shares', 'Value', 'Inv Monthly', 'Invested Tot', 'Avg NAV'])
+    return kernel, tuple(key_bounds), tuple(key_mults)
 
-        shares, inv_total, avg_nav = 0, 0, 0
+def get_multiplier(delta, bounds, mults):
+    """
+    Define multiplier for single investment
 
-        for close in data['Close']:
-            try:
-                delta = ((close - avg_nav) * 100) / avg_nav
-            except ZeroDivisionError:
+    Parameters
+    ----------
+    float delta: Percentage of difference between close price and average price paid
+    list bounds: Tier boundaries, as returned by compile_tiers
+    list mults: Tier multipliers, as returned by compile_tiers
+    """
+
+    return mults[bisect.bisect_right(bounds, delta)]
+
+def get_trial_metrics(values):
+    """
+    Get last value, all-time-high drawdown, max drawdown, and time to recovery in a single pass
+
+    Parameters
+    ----------
+    list values: Monthly values of the trial
+    """
+
+    ath = ath_low = cumprod = prev_peak = max_dd = trough = recovery = None
+
+    for month, value in enumerate(values):
+        if ath is None or value > ath:
+            ath = ath_low = value
+        elif value < ath_low:
+            ath_low = value
+
+        if month == 0:
+            continue
+
+        cumprod = (1 + (value / values[month-1] - 1)) * (cumprod if month > 1 else 1)
+        wealth_index = 1000 * cumprod
+        prev_peak = wealth_index if month == 1 else max(prev_peak, wealth_index)
+
+        if month < 2:
+            continue
+
+        # drawdowns are matched to the value two months earlier, as in the original trial files
+        drawdown = (wealth_index - prev_peak) / prev_peak * 100
+        index = month - 2
+
+        if max_dd is None or drawdown < max_dd:
+            max_dd, trough, recovery = drawdown, index, None
+        elif recovery is None and values[index] >= values[trough]:
+            recovery = index
+
+    ath_drawdown = 0 - (100 - (ath_low * 100 / ath))
+
+    if recovery is None:
+        recovery = len(values) - 2
+
+    return values[-1], ath_drawdown, max_dd, recovery - trough
+
+def append_mapper(output_dir, rows):
+    """
+    Append rows to mapper file, writing the header first if needed
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    list rows: Mapper rows
+    """
+
+    mapper_path = os.path.join(output_dir, 'mapper.csv')
+
+    if not os.path.exists(mapper_path):
+        with open_output(mapper_path, 'a') as map_file:
+            csv_mapper = csv.writer(map_file,delimiter=',')
+            csv_mapper.writerow(header)
+
+    with open_output(mapper_path, 'a') as map_file:
+        map_file = csv.writer(map_file,delimiter=',')
+        map_file.writerows(rows)
+
+def parse_mapper_row(fields):
+    """
+    Return mapper row from the fields of a line of mapper.csv
+
+    Parameters
+    ----------
+    list fields: Fields of the line
+    """
+
+    trial, value, inv_total, gain, ath_dd, max_dd, ttr, ranges, mp_ls = fields
+
+    return [
+        int(trial), float(value), int(inv_total) if inv_total.isdigit() else float(inv_total),
+        float(gain), float(ath_dd), float(max_dd), int(ttr), ast.literal_eval(ranges),
+        ast.literal_eval(mp_ls)
+    ]
+
+def read_mapper_tail(output_dir, size, trial):
+    """
+    Drop a half-written last line from mapper.csv and return the rows written after its first size
+    bytes
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    int size: Size of mapper.csv when trial was completed
+    int trial: Last trial completed
+    """
+
+    with open(os.path.join(output_dir, 'mapper.csv'), 'rb+') as map_file:
+        if map_file.seek(0, os.SEEK_END) < size:
+            raise ValueError('mapper.csv is shorter than its checkpoint!')
+
+        map_file.seek(size)
+        tail = map_file.read()
+        complete = tail.rfind(b'\n') + 1
+
+        if complete < len(tail):
+            map_file.truncate(size + complete)
+
+    lines = tail[:complete].decode('utf-8').splitlines()
+    rows = [parse_mapper_row(fields) for fields in csv.reader(lines)]
+
+    if [row[0] for row in rows] != list(range(trial + 1, trial + len(rows) + 1)):
+        raise ValueError('mapper.csv does not match its checkpoint!')
+
+    return rows
+
+def get_result_dtype():
+    """
+    Return the numpy dtype of the records of results.bin, one field for each of result_fields
+    """
+
+    import numpy
+
+    return numpy.dtype(result_fields)
+
+def get_records(rows):
+    """
+    Return mapper rows as an array of fixed-width records, dca ranges and multipliers as nan
+
+    Parameters
+    ----------
+    list rows: Mapper rows
+    """
+
+    import numpy
+
+    records = numpy.zeros(len(rows), dtype=get_result_dtype())
+
+    for i, (name, *_) in enumerate(result_fields[:7]):
+        records[name] = [row[i] for row in rows]
+
+    records['ranges'] = [
+        [row[7][tier] for tier in tiers] if row[7] else numpy.full((7, 2), numpy.nan)
+        for row in rows
+    ]
+    records['multipliers'] = [
+        [row[8][tier] for tier in tiers] if row[8] else numpy.full(7, numpy.nan) for row in rows
+    ]
+
+    # one bit for each range boundary, multiplier, and total invested amount stored as an integer,
+    # so that rows read back are written to csv files exactly as before
+    records['ints'] = [
+        sum(1 << bit for bit, item in enumerate(get_record_items(row)) if isinstance(item, int))
+        for row in rows
+    ]
+
+    return records
+
+def get_record_items(row):
+    """
+    Return range boundaries, multipliers, and total invested amount of a mapper row, in record order
+
+    Parameters
+    ----------
+    list row: Mapper row
+    """
+
+    if not row[7]:
+        return [row[2]]
+
+    bounds = [bound for tier in tiers for bound in row[7][tier]]
+    return bounds + [row[8][tier] for tier in tiers] + [row[2]]
+
+def get_record_row(record):
+    """
+    Return mapper row from a fixed-width record
+
+    Parameters
+    ----------
+    numpy.void record: Record of a trial
+    """
+
+    ints = int(record['ints'])
+
+    if record['trial'] == 0:
+        items = [record['inv_total'].item()]
+    else:
+        items = (
+            record['ranges'].ravel().tolist() + record['multipliers'].tolist()
+            + [record['inv_total'].item()]
+        )
+
+    items = [int(item) if ints >> bit & 1 else item for bit, item in enumerate(items)]
+    inv_total = items[-1]
+
+    if record['trial'] == 0:
+        ranges, mp_ls = 0, 0
+    else:
+        ranges = {tier: items[2 * i:2 * i + 2] for i, tier in enumerate(tiers)}
+        mp_ls = dict(zip(tiers, items[14:21]))
+
+    return [
+        int(record['trial']), float(record['value']), inv_total, float(record['gain']),
+        float(record['ath_dd']), float(record['max_dd']), int(record['ttr']), ranges, mp_ls
+    ]
+
+def append_records(output_dir, rows):
+    """
+    Append rows to results.bin as fixed-width records
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    list rows: Mapper rows
+    """
+
+    with open_output(os.path.join(output_dir, 'results.bin'), 'ab') as results:
+        get_records(rows).tofile(results)
+
+def read_records(output_dir):
+    """
+    Return the records of results.bin, memory-mapped and read-only
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    """
+
+    import numpy
+
+    results_path = os.path.join(output_dir, 'results.bin')
+
+    if not os.path.isfile(results_path):
+        raise FileNotFoundError(f'No results.bin found in {output_dir}!')
+
+    result_dtype = get_result_dtype()
+
+    if os.path.getsize(results_path) < result_dtype.itemsize:
+        return numpy.zeros(0, dtype=result_dtype)
+
+    return numpy.memmap(results_path, dtype=result_dtype, mode='r')
+
+def read_records_tail(output_dir, size, trial):
+    """
+    Drop a half-written last record from results.bin and return the rows written after its first
+    size bytes
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    int size: Size of results.bin when trial was completed
+    int trial: Last trial completed
+    """
+
+    results_path = os.path.join(output_dir, 'results.bin')
+    end = os.path.getsize(results_path)
+
+    if end < size:
+        raise ValueError('results.bin is shorter than its checkpoint!')
+
+    itemsize = get_result_dtype().itemsize
+    complete = (end - size) // itemsize * itemsize
+    if size + complete < end:
+        os.truncate(results_path, size + complete)
+
+    rows = [get_record_row(record) for record in read_records(output_dir)[size // itemsize:]]
+
+    if [row[0] for row in rows] != list(range(trial + 1, trial + len(rows) + 1)):
+        raise ValueError('results.bin does not match its checkpoint!')
+
+    return rows
+
+def get_results_path(config, output_dir):
+    """
+    Return path of the file with the results of every trial
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    """
+
+    return os.path.join(output_dir, 'results.bin' if config.results == 'binary' else 'mapper.csv')
+
+def append_results(config, output_dir, rows):
+    """
+    Append rows to mapper.csv, or to results.bin when saving binary results
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    list rows: Mapper rows
+    """
+
+    if config.results == 'binary':
+        append_records(output_dir, rows)
+    else:
+        append_mapper(output_dir, rows)
+
+def read_results_blocks(output_dir):
+    """
+    Yield the rows of results.bin or mapper.csv, whichever exists, a block at a time
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    """
+
+    if os.path.isfile(os.path.join(output_dir, 'results.bin')):
+        records = read_records(output_dir)
+
+        for start in range(0, len(records), batch_size):
+            yield [get_record_row(record) for record in records[start:start + batch_size]]
+        return
+
+    with open(os.path.join(output_dir, 'mapper.csv'), 'r', encoding='utf-8') as map_file:
+        mapper = map(parse_mapper_row, itertools.islice(csv.reader(map_file), 1, None))
+
+        while rows := list(itertools.islice(mapper, batch_size)):
+            yield rows
+
+def export_results(output_dir, export_path):
+    """
+    Export results.bin to a csv file, or to a parquet file when export_path ends with .parquet, with
+    one column for each range boundary and multiplier
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    str export_path: Path to the exported file
+    """
+
+    import pandas
+
+    records = read_records(output_dir)
+    columns = header[:7]
+    bounds = [f'{tier} {bound}' for tier in tiers for bound in ('lower', 'upper')]
+    mults = [f'{tier} multiplier' for tier in tiers]
+
+    def get_frame(block):
+        return pandas.concat([
+            pandas.DataFrame({
+                column: block[name] for column, (name, *_) in zip(columns, result_fields)
+            }),
+            pandas.DataFrame(block['ranges'].reshape(len(block), 14), columns=bounds),
+            pandas.DataFrame(block['multipliers'], columns=mults)
+        ], axis=1)
+
+    if export_path.endswith('.parquet'):
+        get_frame(records).to_parquet(export_path, index=False)
+        return
+
+    with open_output(export_path) as export:
+        for start in range(0, max(len(records), 1), batch_size):
+            frame = get_frame(records[start:start + batch_size])
+            frame.to_csv(export, index=False, header=start == 0)
+
+def get_mapper_row(trial, values, inv_total, ranges, mp_ls):
+    """
+    Return mapper row with the results of a trial
+
+    Parameters
+    ----------
+    int trial: Trial number
+    list values: Monthly values of the trial
+    float inv_total: Total invested amount
+    dict ranges: Trial ranges
+    dict mp_ls: List of defined multipliers
+    """
+
+    with instruments.timer('metrics'):
+        last_value, ath_dd, max_dd, ttr = get_trial_metrics(values)
+
+    if isinstance(trial, int):
+        gain = (last_value * 100 / inv_total) - 100
+
+    return [trial, last_value, inv_total, gain, ath_dd, max_dd, ttr, ranges, mp_ls]
+
+def run_dca_analysis(output_dir, data):
+    """
+    Run DCA analysis from input data and return its mapper row
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    """
+
+    shares, inv_total, avg_nav = 0, 0, 0
+    values = []
+
+    with open_output(get_trial_path(output_dir, 0)) as results:
+        csv_res = csv.writer(results, delimiter=',')
+        csv_res.writerow(['Close', 'Shares', 'Value', 'Inv Monthly', 'Invested Tot', 'Avg NAV'])
+
+        for close in data['Close']:
+            inv_monthly = 100
+            inv_total += inv_monthly
+            shares += inv_monthly / close
+            avg_nav = inv_total / shares
+            value = shares * close
+            values.append(value)
+
+            csv_res.writerow([close, shares, value, inv_monthly, inv_total, avg_nav])
+
+    return get_mapper_row(0, values, inv_total, 0, 0)
+
+def generate_ranges_random(config, rng=random):
+    """
+    Generate random ranges
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    random.Random rng: Random number generator
+    """
+
+    ranges = {}
+    range_upper_old = None
+
+    if config.force_neg:
+        upper_limit_neg = 0
+    else:
+        upper_limit_neg = 15
+
+    for tier in tiers:
+
+        if tier[5] == 'n':
+            upper_limit = upper_limit_neg
+        else:
+            upper_limit = 15
+
+        if range_upper_old is None:
+            range_lower = 9999
+            range_upper = round(rng.uniform(-15, upper_limit), 1)
+            range_upper_old = range_upper
+        else:
+            range_lower = range_upper_old
+            range_upper = round(rng.uniform(range_lower, upper_limit), 1)
+            range_upper_old = range_upper
+
+        if tier == 'tier_p3':
+            range_upper = 9999
+
+        ranges[tier] = [range_lower, range_upper]
+
+    return ranges
+
+def generate_ranges_incremental(i):
+    """
+    Generate incremental ranges
+
+    Parameters
+    ----------
+    float i: increment
+    """
+
+    ranges = {}
+
+    for tier in tiers:
+        if tier == 'tier_00':
+            range_lower = -i
+            range_upper = i
+        elif tier[6] == '1':
+            range_lower = i
+            range_upper = i + 2.5
+        elif tier[6] == '2':
+            range_lower = i + 2.5
+            range_upper = i + 5
+        elif tier[6] == '3':
+            range_lower = i + 5
+            range_upper = 9999
+
+        if tier[5] == 'n':
+            range_lower, range_upper = 0 - range_upper, 0 - range_lower
+
+        ranges[tier] = [range_lower, range_upper]
+
+    return ranges
+
+def run_smart_dca_analysis(
+    output_dir, trial, data, multipliers, ranges=None, save=True, trial_values=None,
+    trial_contributions=None
+):
+    """
+    Run by-range smart dca analysis from input data and return its mapper row
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    int trial: Trian number
+    pandas.DataFrame data: Historical data for selected asset
+    dict multipliers: List of defined multipliers
+    dict ranges: Trial ranges
+    bool save: Save the trial to its own file
+    list trial_values: Monthly values of previous trials, to append the values of this trial to
+    list trial_contributions: Monthly invested amounts of previous trials, to append the ones of
+    this trial to
+    """
+
+    bounds, mults = compile_tiers(ranges, multipliers)
+
+    shares, inv_total, avg_nav = 0, 0, 0
+    values, contributions, trial_rows = [], [], []
+
+    with instruments.timer('simulate'):
+        for close in data['Close']:
+            try:
+                delta = ((close - avg_nav) * 100) / avg_nav
+            except ZeroDivisionError:
                 delta = 0
 
-            multiplier = get_multiplier(delta, multipliers, ranges)
+            multiplier = get_multiplier(delta, bounds, mults)
+
+            inv_monthly = 100 * multiplier
+            inv_total += inv_monthly
+            shares += inv_monthly / close
+            avg_nav = inv_total / shares
+            value = shares * close
+            values.append(value)
+            contributions.append(inv_monthly)
+
+            if save:
+                trial_rows.append([close, shares, value, inv_monthly, inv_total, avg_nav])
+
+    if save:
+        trial_path = get_trial_path(output_dir, trial)
+
+        with instruments.timer('trial_files'), open_output(trial_path) as res:
+            csv_res = csv.writer(res, delimiter=',')
+            csv_res.writerow(['Close', 'Shares', 'Value', 'Inv Monthly', 'Invested Tot', 'Avg NAV'])
+            csv_res.writerows(trial_rows)
+
+    if trial_values is not None:
+        trial_values.append(values)
+
+    if trial_contributions is not None:
+        trial_contributions.append(contributions)
+
+    return get_mapper_row(trial, values, inv_total, ranges, multipliers)
+
+def get_batch_metrics(values):
+    """
+    Get last value, all-time-high drawdown, max drawdown, and time to recovery for every trial
+
+    Parameters
+    ----------
+    numpy.ndarray values: Monthly values, one row per trial
+    """
+
+    import numpy
+
+    rows = numpy.arange(values.shape[0])
+    months = values.shape[1]
+
+    peak = values.argmax(axis=1)
+    suffix_min = numpy.minimum.accumulate(values[:, ::-1], axis=1)[:, ::-1]
+    ath_dd = 0 - (100 - (suffix_min[rows, peak] * 100 / values[rows, peak]))
+
+    msr = values[:, 1:] / values[:, :-1] - 1
+    wealth_index = 1000 * numpy.cumprod(1 + msr, axis=1)
+    prev_peaks = numpy.maximum.accumulate(wealth_index, axis=1)
+    drawdowns = ((wealth_index - prev_peaks) / prev_peaks)[:, 1:] * 100
+
+    trough = drawdowns.argmin(axis=1)
+    max_dd = drawdowns[rows, trough]
+
+    cols = numpy.arange(months - 2)
+    recovered = (values[:, :-2] >= values[rows, trough][:, None]) & (cols > trough[:, None])
+    ttr = numpy.where(recovered.any(axis=1), recovered.argmax(axis=1), months - 2) - trough
+
+    return values[:, -1], ath_dd, max_dd, ttr
+
+def get_extended_metrics(values, contributions, risk_free=0):
+    """
+    Get money-weighted return, cagr, volatility, sharpe, sortino and calmar ratios, ulcer index, and
+    average capital deployed for every trial at once
+
+    Parameters
+    ----------
+    numpy.ndarray values: Monthly values, one row per trial
+    numpy.ndarray contributions: Monthly invested amounts, one row per trial
+    float risk_free: Yearly risk-free rate, in percent
+    """
+
+    import numpy
+
+    months = values.shape[1]
+    invested = numpy.cumsum(contributions, axis=1)
+    last_value, inv_total = values[:, -1], invested[:, -1]
+
+    # monthly log rate at which the contributions grow into the last value, newton steps starting
+    # above the root decrease monotonically to it, since the sum of exponentials is increasing and
+    # convex
+    durations = numpy.arange(months - 1, -1, -1)
+    mean_duration = numpy.maximum((contributions * durations).sum(axis=1) / inv_total, 1)
+    rate = numpy.log(last_value / inv_total) / mean_duration
+
+    for _ in range(xirr_iterations):
+        growth = contributions * numpy.exp(rate[:, None] * durations)
+        step = (growth.sum(axis=1) - last_value) / (growth * durations).sum(axis=1)
+        rate -= step
+
+        if numpy.abs(step).max() < 1e-12:
+            break
+
+    xirr = numpy.expm1(rate * 12) * 100
+    cagr = ((last_value / inv_total) ** (12 / (months - 1)) - 1) * 100
+
+    # returns of the value of each unit invested, contributions would otherwise count as returns
+    multiple = values / invested
+    returns = multiple[:, 1:] / multiple[:, :-1] - 1
+    excess = returns - ((1 + risk_free / 100) ** (1 / 12) - 1)
+
+    drawdowns = (multiple / numpy.maximum.accumulate(multiple, axis=1) - 1) * 100
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        volatility = returns.std(axis=1, ddof=1) * 12**0.5 * 100
+        sharpe = excess.mean(axis=1) * 12 * 100 / volatility
+        downside = numpy.sqrt((numpy.minimum(excess, 0) ** 2).mean(axis=1))
+        sortino = excess.mean(axis=1) * 12**0.5 / downside
+        calmar = cagr / -drawdowns.min(axis=1)
+
+    return {
+        'XIRR': xirr,
+        'CAGR': cagr,
+        'Volatility': volatility,
+        'Sharpe': sharpe,
+        'Sortino': sortino,
+        'Calmar': calmar,
+        'Ulcer Index': numpy.sqrt((drawdowns ** 2).mean(axis=1)),
+        'Avg Deployed': invested.mean(axis=1)
+    }
+
+def simulate_trials(closes, bounds, mults, mults_int, contributions=None):
+    """
+    Simulate smart dca for every trial at once, one month at a time, return values, total invested
+    amounts, and whether only integer multipliers were used
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices, shared by all trials or one row per trial
+    numpy.ndarray bounds: Tier boundaries, one row per trial
+    numpy.ndarray mults: Tier multipliers, one row per trial
+    numpy.ndarray mults_int: Whether each multiplier is an integer, one row per trial
+    numpy.ndarray contributions: Filled with the amount invested every month, one row per trial,
+    None to skip
+    """
+
+    import numpy
+
+    rows = numpy.arange(len(bounds))
+    unique_bounds = numpy.unique(bounds, axis=0)
+
+    shares, inv_total, avg_nav = numpy.zeros((3, len(bounds)))
+    all_int = numpy.ones(len(bounds), dtype=bool)
+    values = numpy.empty((len(bounds), closes.shape[-1]))
+
+    for month, close in enumerate(closes.T):
+        if month == 0:
+            delta = numpy.zeros(len(bounds))
+        else:
+            delta = ((close - avg_nav) * 100) / avg_nav
+
+        if len(unique_bounds) == 1:
+            tier = numpy.searchsorted(bounds[0], delta, side='right')
+        else:
+            tier = (delta[:, None] >= bounds).sum(axis=1)
+        all_int &= mults_int[rows, tier]
+
+        inv_monthly = 100 * mults[rows, tier]
+        inv_total += inv_monthly
+        shares += inv_monthly / close
+        avg_nav = inv_total / shares
+        values[:, month] = shares * close
+
+        if contributions is not None:
+            contributions[:, month] = inv_monthly
+
+    return values, inv_total, all_int
+
+def simulate_trials_kernel(
+    closes, bounds, mults, mults_int, values, inv_totals, all_int, contributions
+):
+    """
+    Simulate smart dca one trial at a time over plain arrays, compiled by numba when available,
+    filling values, total invested amounts, and whether only integer multipliers were used
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices
+    numpy.ndarray bounds: Tier boundaries, one row per trial
+    numpy.ndarray mults: Tier multipliers, one row per trial
+    numpy.ndarray mults_int: Whether each multiplier is an integer, one row per trial
+    numpy.ndarray values: Monthly values, one row per trial, filled in place
+    numpy.ndarray inv_totals: Total invested amount of each trial, filled in place
+    numpy.ndarray all_int: Whether each trial only used integer multipliers, all True, updated in
+    place
+    numpy.ndarray contributions: Amount invested every month, one row per trial, filled in place
+    unless empty
+    """
+
+    trials, months = bounds.shape[0], closes.shape[0]
+
+    for trial in prange(trials):
+        shares, inv_total, avg_nav = 0.0, 0.0, 0.0
+
+        for month in range(months):
+            close = closes[month]
+
+            if month == 0:
+                delta = 0.0
+            else:
+                delta = ((close - avg_nav) * 100) / avg_nav
+
+            tier = 0
+            while tier < bounds.shape[1] and delta >= bounds[trial, tier]:
+                tier += 1
+
+            if not mults_int[trial, tier]:
+                all_int[trial] = False
+
+            inv_monthly = 100 * mults[trial, tier]
+            inv_total += inv_monthly
+            shares += inv_monthly / close
+            avg_nav = inv_total / shares
+            values[trial, month] = shares * close
+
+            if contributions.shape[0]:
+                contributions[trial, month] = inv_monthly
+
+        inv_totals[trial] = inv_total
+
+def get_simulate_trials_jit():
+    """
+    Import numba and compile simulate_trials_kernel on first use, numba takes longer to import than
+    most runs need
+    """
+
+    global prange, simulate_trials_jit
+
+    if simulate_trials_jit is None:
+        import numba
+
+        prange = numba.prange
+        simulate_trials_jit = numba.njit(parallel=True, cache=True)(simulate_trials_kernel)
+
+    return simulate_trials_jit
+
+def simulate_trials_numba(closes, bounds, mults, mults_int, contributions=None, kernel=None):
+    """
+    Simulate smart dca for every trial with simulate_trials_kernel, return values, total invested
+    amounts, and whether only integer multipliers were used
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices
+    numpy.ndarray bounds: Tier boundaries, one row per trial
+    numpy.ndarray mults: Tier multipliers, one row per trial
+    numpy.ndarray mults_int: Whether each multiplier is an integer, one row per trial
+    numpy.ndarray contributions: Filled with the amount invested every month, one row per trial,
+    None to skip
+    function kernel: Kernel to run, None for the one compiled by numba
+    """
+
+    import numpy
+
+    values = numpy.empty((len(bounds), len(closes)))
+    inv_totals = numpy.empty(len(bounds))
+    all_int = numpy.ones(len(bounds), dtype=bool)
+
+    if contributions is None:
+        contributions = numpy.empty((0, 0))
+
+    (kernel or get_simulate_trials_jit())(
+        closes, bounds, mults, mults_int, values, inv_totals, all_int, contributions
+    )
+
+    return values, inv_totals, all_int
+
+def run_smart_dca_batch(trial, data, params, invested=False):
+    """
+    Run by-range smart dca analysis for a batch of trials at once and return their mapper rows,
+    monthly values, and monthly invested amounts, None unless requested
+
+    Parameters
+    ----------
+    int trial: Number of the first trial in the batch
+    pandas.DataFrame data: Historical data for selected asset
+    list params: Trial ranges and multipliers, as (ranges, multipliers) tuples
+    bool invested: Return the amount invested every month by each trial
+    """
+
+    import numpy
+
+    closes = data['Close'].to_numpy(dtype=float)
+
+    compiled = [compile_tiers(ranges, mp_ls) for ranges, mp_ls in params]
+
+    bounds = numpy.array([trial_bounds for trial_bounds, _ in compiled], dtype=float)
+    mults = numpy.array([trial_mults for _, trial_mults in compiled], dtype=float)
+    mults_int = numpy.array([
+        [isinstance(mult, int) for mult in trial_mults] for _, trial_mults in compiled
+    ])
+
+    contributions = numpy.empty((len(params), len(closes))) if invested else None
+
+    with instruments.timer('simulate'):
+        if not has_numba:
+            simulate = simulate_trials
+        else:
+            simulate = simulate_trials_numba
+
+        values, inv_total, all_int = simulate(closes, bounds, mults, mults_int, contributions)
+
+    with instruments.timer('metrics'):
+        last_value, ath_dd, max_dd, ttr = get_batch_metrics(values)
+        gain = (last_value * 100 / inv_total) - 100
+
+    inv_total = [int(inv) if is_int else inv for inv, is_int in zip(inv_total.tolist(), all_int)]
+
+    metrics = zip(
+        last_value.tolist(), inv_total, gain.tolist(), ath_dd.tolist(), max_dd.tolist(),
+        ttr.tolist()
+    )
+
+    rows = [
+        [trial + i, *row, ranges, mp_ls]
+        for i, (row, (ranges, mp_ls)) in enumerate(zip(metrics, params))
+    ]
+
+    return rows, values, contributions
+
+def get_row_tiers(rows):
+    """
+    Return tier boundaries, multipliers and whether each multiplier is an integer, one row per
+    trial, from mapper rows, dca included
+
+    Parameters
+    ----------
+    list rows: Mapper rows
+    """
+
+    import numpy
+
+    bounds, mults, mults_int = [], [], []
+
+    for row in rows:
+        if row[0] == 0:
+            trial_bounds, trial_mults = [0] * 6, [1] * 7
+        else:
+            trial_bounds, trial_mults = compile_tiers(row[7], row[8])
+
+        bounds.append(trial_bounds)
+        mults.append(trial_mults)
+        mults_int.append([isinstance(mult, int) for mult in trial_mults])
+
+    return numpy.array(bounds, dtype=float), numpy.array(mults, dtype=float), numpy.array(mults_int)
+
+def get_rows_metrics(config, data, rows):
+    """
+    Simulate trials from their mapper rows and return their extended metrics
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows, dca included
+    """
+
+    import numpy
+
+    closes = data['Close'].to_numpy(dtype=float)
+    contributions = numpy.empty((len(rows), len(closes)))
+
+    if not has_numba:
+        values, _, _ = simulate_trials(closes, *get_row_tiers(rows), contributions)
+    else:
+        values, _, _ = simulate_trials_numba(closes, *get_row_tiers(rows), contributions)
+
+    return get_extended_metrics(values, contributions, config.risk_free or 0)
+
+def get_values_metrics(values, contributions, risk_free):
+    """
+    Return the extended metrics of a block of trials from their monthly values and invested amounts,
+    one tuple per trial
+
+    Parameters
+    ----------
+    numpy.ndarray values: Monthly values, one row per trial
+    numpy.ndarray contributions: Monthly invested amounts, one row per trial
+    float risk_free: Yearly risk-free rate, in percent
+    """
+
+    with instruments.timer('extended_metrics'):
+        metrics = get_extended_metrics(values, contributions, risk_free)
+
+        return list(zip(*(column.tolist() for column in metrics.values())))
+
+def append_extended_metrics(config, output_dir, data, rows, metrics=None):
+    """
+    Append the extended metrics of a block of trials to metrics.csv, writing the header first if
+    needed
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows
+    list metrics: Extended metrics of each trial, None to simulate the trials again
+    """
+
+    if not rows:
+        return
+
+    if metrics is None:
+        rows_metrics = get_rows_metrics(config, data, rows)
+        metrics = list(zip(*(values.tolist() for values in rows_metrics.values())))
+
+    metrics_path = os.path.join(output_dir, 'metrics.csv')
+    new = not os.path.isfile(metrics_path) or os.path.getsize(metrics_path) == 0
+
+    with open_output(metrics_path, 'a') as metrics_file:
+        csv_metrics = csv.writer(metrics_file, delimiter=',')
+        if new:
+            csv_metrics.writerow(['Trial', *metric_names])
+        csv_metrics.writerows([row[0], *trial_metrics] for row, trial_metrics in zip(rows, metrics))
+
+def print_extended_metrics(config, data, rows):
+    """
+    Show the extended metrics of dca and the given trials
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows of the trials to show, dca first
+    """
+
+    metrics = get_rows_metrics(config, data, rows)
+
+    print('\nExtended metrics')
+    print(f'{"<trial>":<10} ' + ' '.join(f'{"<" + name.lower() + ">":>14}' for name in metrics))
+
+    for i, row in enumerate(rows):
+        trial = 'dca' if row[0] == 0 else f'[#{row[0]}]'
+        print(f'{trial:<10} ' + ' '.join(f'{values[i]:>14.2f}' for values in metrics.values()))
+
+def get_trial_seed(seed, trial):
+    """
+    Derive the seed of a single trial from the base seed
+
+    Parameters
+    ----------
+    int seed: Base seed
+    int trial: Trial number
+    """
+
+    return int.from_bytes(hashlib.sha256(f'{seed}:{trial}'.encode()).digest()[:8], 'big')
+
+def get_trial_params(config, trial, seed, ranges=None, multipliers=None):
+    """
+    Return ranges and multipliers of a trial
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    int trial: Trial number
+    int seed: Base seed, None to use the global random state
+    dict ranges: Trial ranges, None to generate random ranges
+    dict multipliers: List of defined multipliers, None to generate random multipliers
+    """
+
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(get_trial_seed(seed, trial))
+
+    if not multipliers:
+        multipliers = gen_multipliers(config, rng)
+
+    if not ranges:
+        ranges = generate_ranges_random(config, rng)
+
+    return ranges, multipliers
+
+def run_cached_trials(trial, params, kernel, run):
+    """
+    Run only the trials neither cached nor repeated in the block and return the mapper rows and
+    extended metrics of all trials, the metrics are empty unless run returns them
+
+    Parameters
+    ----------
+    int trial: Number of the first trial in the block
+    list params: Trial ranges and multipliers, as (ranges, multipliers) tuples
+    str kernel: Simulation run by run, as returned by get_kernel
+    function run: Return the mapper rows and extended metrics, or None, of a list of (ranges,
+    multipliers) tuples
+    """
+
+    keys = [get_trial_key(ranges, multipliers, kernel) for ranges, multipliers in params]
+    results, misses = {}, {}
+
+    for i, key in enumerate(keys):
+        if key in results or key in misses:
+            continue
+
+        cached = trial_cache.get(key)
+        if cached is None:
+            misses[key] = i
+        else:
+            results[key] = cached
+
+    if misses:
+        rows, metrics = run([params[i] for i in misses.values()])
+
+        for key, row, trial_metrics in zip(misses, rows, metrics or itertools.repeat(())):
+            results[key] = (*row[1:7], *trial_metrics)
+            trial_cache.put(key, results[key])
+
+    instruments.count('cache_hits', len(keys) - len(misses))
+    instruments.count('cache_misses', len(misses))
+
+    rows = [
+        [trial + i, *results[key][:6], ranges, multipliers]
+        for i, (key, (ranges, multipliers)) in enumerate(zip(keys, params))
+    ]
+
+    return rows, [results[key][6:] for key in keys]
+
+def get_kernel(config):
+    """
+    Return the simulation used by the trials of a run, with the risk-free rate of their extended
+    metrics if saved, since cached results include them
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    """
+
+    if not (config.batch or config.optimize):
+        kernel = 'loop'
+    else:
+        kernel = 'numba' if has_numba else 'numpy'
+
+    if config.extended_metrics:
+        kernel += f':metrics={config.risk_free or 0}'
+
+    return kernel
+
+def run_trials(config, output_dir, trial, data, seed, params_ls):
+    """
+    Run a block of consecutive trials and return their mapper rows and extended metrics, None unless
+    requested
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    int trial: Number of the first trial in the block
+    pandas.DataFrame data: Historical data for selected asset
+    int seed: Base seed, None to use the global random state
+    list params_ls: Ranges and multipliers of each trial, None to generate them randomly
+    """
+
+    import numpy
+
+    params = [
+        get_trial_params(config, trial + i, seed, ranges, multipliers)
+        for i, (ranges, multipliers) in enumerate(params_ls)
+    ]
+
+    # trials of runs that can stop early are saved by the main process, up to the stopping trial
+    save = get_save_trials(config) is None and not config.patience
+    risk_free = (config.risk_free or 0) if config.extended_metrics else None
+
+    def run(run_params):
+        if config.batch:
+            rows, values, contributions = run_smart_dca_batch(
+                trial, data, run_params, risk_free is not None
+            )
+        else:
+            values, contributions = [], []
+            rows = [
+                run_smart_dca_analysis(
+                    output_dir, trial + i, data, multipliers, ranges=ranges, save=save,
+                    trial_values=values, trial_contributions=contributions
+                )
+                for i, (ranges, multipliers) in enumerate(run_params)
+            ]
+
+        if risk_free is None:
+            return rows, None
+
+        values, contributions = numpy.asarray(values), numpy.asarray(contributions)
+        return rows, get_values_metrics(values, contributions, risk_free)
+
+    # trials saved to their own files in loop mode are simulated anyway
+    if trial_cache.size and (config.batch or not save):
+        rows, metrics = run_cached_trials(trial, params, get_kernel(config), run)
+        if risk_free is None:
+            metrics = None
+    else:
+        rows, metrics = run(params)
+
+    if config.batch and save:
+        with instruments.timer('trial_files'):
+            save_trials(output_dir, data, rows)
+
+    return rows, metrics
+
+def get_save_trials(config):
+    """
+    Return number of best trials to save for each result, None to save all trials
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    """
+
+    if config.save_trials is None:
+        return 0 if config.batch or config.optimize else None
+
+    if config.save_trials == 'all':
+        return None
+
+    if config.save_trials == 'none':
+        return 0
+
+    if config.save_trials.startswith('top-') and config.save_trials[4:].isdigit():
+        return int(config.save_trials[4:])
+
+    raise ValueError('Invalid trials to save! Use none, top-K or all')
+
+def update_top_trials(top_trials, rows, keep):
+    """
+    Keep the best trials for each result in bounded min-heaps
+
+    Parameters
+    ----------
+    list top_trials: Heaps of (score, trial, row) tuples, one for each result
+    list rows: Mapper rows of the new trials
+    int keep: Number of trials to keep for each result
+    """
+
+    for row in rows:
+        scores = [row[1], row[3], -row[4], -row[5], -row[6]]
+
+        for heap, score in zip(top_trials, scores):
+            if len(heap) < keep:
+                heapq.heappush(heap, (score, row[0], row))
+            else:
+                heapq.heappushpop(heap, (score, row[0], row))
+
+def save_trials(output_dir, data, rows):
+    """
+    Replay trials from their mapper rows and save them to their own files
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows of the trials to save
+    """
+
+    for row in rows:
+        run_smart_dca_analysis(output_dir, row[0], data, row[8], ranges=row[7])
+
+def init_worker(config, data):
+    """
+    Store backtest settings and historical data once per worker process
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    pandas.DataFrame data: Historical data for selected asset
+    """
+
+    global worker_config, worker_data
+    worker_config, worker_data = config, data
+    trial_cache.setup(config, data)
+
+def run_worker_trials(output_dir, trial, seed, params_ls):
+    """
+    Run a block of trials in a worker process, on the data stored by init_worker, and return their
+    mapper rows and extended metrics with the timers and counters of the block
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    int trial: Number of the first trial in the block
+    int seed: Base seed
+    list params_ls: Ranges and multipliers of each trial, None to generate them randomly
+    """
+
+    instruments.reset()
+    rows, metrics = run_trials(worker_config, output_dir, trial, worker_data, seed, params_ls)
+
+    return rows, metrics, instruments.snapshot()
+
+def print_res(str_1, str_2, str_3, str_4='', mes='', quiet=False):
+    """
+    Print results in table format
+
+    Parameters
+    ----------
+    str str_1: String 1
+    str str_2: String 2
+    str str_3: String 3
+    str str_4: String 4
+    str mes: Unit of measurement
+    bool quiet: Disable verbosity
+    """
+
+    def space_1(string):
+        return ' ' * (25 - len(str(string)))
+
+    def space_2(string):
+        return ' ' * (20 - len(str(string)) - len(mes) + 1)
+
+    if mes:
+        str_3 = f'[#{str_3}]'
+
+    if not quiet:
+        print(str_1, space_1(str_1), str_2, mes, space_2(str_2), str_3, str_4, mes)
+
+def update_best_results(best, rows):
+    """
+    Update best results with new mapper rows
+
+    Parameters
+    ----------
+    dict best: Best results, updated in place
+    list rows: Mapper rows
+    """
+
+    for row in rows:
+        if row[0] == 0:
+            best['dca'] = row
+            continue
+
+        if 'value' not in best or row[1] >= best['value'][0]:
+            best['value'] = (round(row[1], 2), row)
+
+        if 'gain' not in best or row[3] >= best['gain'][0]:
+            best['gain'] = (round(row[3], 2), row)
+
+        if 'ath_dd' not in best or row[4] <= best['ath_dd'][0]:
+            best['ath_dd'] = (round(row[4], 2), row)
+
+        if 'max_dd' not in best or row[5] <= best['max_dd'][0]:
+            best['max_dd'] = (round(row[5], 2), row)
+
+        if 'ttr' not in best or row[6] <= best['ttr'][0]:
+            best['ttr'] = (int(row[6]), row)
+
+def update_pareto_frontier(frontier, rows):
+    """
+    Return trials not dominated by any other on gain, max drawdown, and time to recovery
+
+    Parameters
+    ----------
+    list frontier: Mapper rows of the current frontier
+    list rows: Mapper rows of the new trials
+    """
+
+    points = {}
+    for row in frontier + [row for row in rows if row[0] != 0]:
+        points.setdefault((row[3], row[5], row[6]), []).append(row)
+
+    ttrs = sorted({ttr for _, _, ttr in points})
+    max_dds = [float('-inf')] * (len(ttrs) + 1)
+    frontier = []
+
+    for gain, max_dd, ttr in sorted(points, key=lambda point: (-point[0], -point[1], point[2])):
+        index = bisect.bisect_right(ttrs, ttr)
+
+        # every trial seen so far has a higher gain: look for one with a lower max drawdown and ttr
+        i, best_dd = index, float('-inf')
+        while i > 0:
+            best_dd = max(best_dd, max_dds[i])
+            i -= i & -i
+
+        if best_dd >= max_dd:
+            continue
+
+        frontier.extend(points[(gain, max_dd, ttr)])
+
+        i = index
+        while i <= len(ttrs):
+            max_dds[i] = max(max_dds[i], max_dd)
+            i += i & -i
+
+    return frontier
+
+class EarlyStop:
+    """
+    Track how the best value, gain and max drawdown improve, and tell when no trial has improved any
+    of them by more than a minimum change for a number of trials
+    """
+
+    results = {'value': (1, 1), 'gain': (3, 1), 'max drawdown': (5, -1)}
+
+    def __init__(self, patience, min_delta=0):
+        self.patience, self.min_delta = patience, min_delta
+        self.best = {}
+        self.improved = 0
+        self.reason = None
+
+    def update(self, rows):
+        """
+        Track new mapper rows, return how many of them to keep: all of them, or up to the trial
+        where the run stops, with the reason saved in self.reason
+
+        Parameters
+        ----------
+        list rows: Mapper rows
+        """
+
+        for i, row in enumerate(rows):
+            if row[0] == 0:
+                continue
+
+            for name, (col, sign) in self.results.items():
+                min_change = abs(self.best.get(name, 0)) * self.min_delta / 100
+
+                if name not in self.best or sign * (row[col] - self.best[name]) > min_change:
+                    self.best[name] = row[col]
+                    self.improved = row[0]
+
+            if row[0] - self.improved >= self.patience:
+                self.reason = (
+                    f'no improvement of best {", ".join(self.results)} by more than '
+                    f'{self.min_delta}% in {self.patience} trials, since trial {self.improved}'
+                )
+                return i + 1
+
+        return len(rows)
+
+def get_results(output_dir, best, frontier, quiet=False):
+    """
+    Save and show best results
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    dict best: Best results
+    list frontier: Mapper rows of the pareto frontier
+    bool quiet: Disable verbosity
+    """
+
+    dca = best['dca']
+    best_value, value_line = best['value']
+    best_gain, gain_line = best['gain']
+    best_ath_dd, ath_dd_line = best['ath_dd']
+    best_max_dd, max_dd_line = best['max_dd']
+    best_ttr, ttr_line = best['ttr']
+
+    with open_output(os.path.join(output_dir, 'best_results.csv'), 'a') as results:
+        results = csv.writer(results, delimiter=',')
+        results.writerow(header)
+        results.writerow(dca)
+        results.writerow(value_line)
+        results.writerow(gain_line)
+        results.writerow(ath_dd_line)
+        results.writerow(max_dd_line)
+        results.writerow(ttr_line)
+
+    with open_output(os.path.join(output_dir, 'pareto_frontier.csv')) as results:
+        results = csv.writer(results, delimiter=',')
+        results.writerow(header)
+        results.writerows(frontier)
+
+    print_res('<stat>', '<dca>', '<smart dca trial>', quiet=quiet)
+    print_res('Value', round(float(dca[1]), 2), value_line[0], best_value, '$', quiet)
+    print_res('Gain', int(float(dca[3])), gain_line[0], best_gain, '%', quiet)
+    print_res(
+        'All-time-high drawdown', round(float(dca[4]), 2), ath_dd_line[0], best_ath_dd, '%', quiet
+    )
+    print_res('Max drawdown ', round(float(dca[5]), 2), max_dd_line[0], best_max_dd, '%', quiet)
+    print_res('Time to recovery', int(dca[6]), ttr_line[0], best_ttr, 'months', quiet)
+
+def get_start_dates(months, horizon):
+    """
+    Return first and last month of every start date, each investing for horizon months or until the
+    end
+
+    Parameters
+    ----------
+    int months: Number of months of historical data
+    int horizon: Months invested from each start date, None to invest until the end
+    """
+
+    import numpy
+
+    if horizon is None:
+        starts = numpy.arange(months)
+        return starts, numpy.full(months, months - 1)
+
+    if not 0 < horizon <= months:
+        raise ValueError('Horizon must be between 1 and the number of months of historical data!')
+
+    starts = numpy.arange(months - horizon + 1)
+    return starts, starts + horizon - 1
+
+def simulate_dca_start_dates(closes, starts, ends):
+    """
+    Return final value and total invested amount of plain dca from every start date, with prefix
+    sums of the shares bought each month
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices
+    numpy.ndarray starts: First month of each start date
+    numpy.ndarray ends: Last month of each start date
+    """
+
+    import numpy
+
+    cum_shares = numpy.concatenate(([0.0], numpy.cumsum(100 / closes)))
+
+    shares = cum_shares[ends + 1] - cum_shares[starts]
+    inv_total = 100.0 * (ends - starts + 1)
+
+    return shares * closes[ends], inv_total
+
+def simulate_start_dates(closes, starts, ends, bounds, mults):
+    """
+    Return final value and total invested amount of smart dca from every start date, simulating all
+    start dates at once, one month at a time
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices
+    numpy.ndarray starts: First month of each start date
+    numpy.ndarray ends: Last month of each start date
+    list bounds: Tier boundaries
+    list mults: Tier multipliers
+    """
+
+    import numpy
+
+    bounds, mults = numpy.array(bounds, dtype=float), numpy.array(mults, dtype=float)
+    shares, inv_total, avg_nav = numpy.zeros((3, len(starts)))
+
+    for offset in range((ends - starts).max() + 1):
+        active = starts + offset <= ends
+        close = closes[numpy.minimum(starts + offset, ends)]
+
+        if offset == 0:
+            delta = numpy.zeros(len(starts))
+        else:
+            delta = ((close - avg_nav) * 100) / avg_nav
+
+        tier = numpy.searchsorted(bounds, delta, side='right')
+        inv_monthly = numpy.where(active, 100 * mults[tier], 0)
+        inv_total += inv_monthly
+        shares += inv_monthly / close
+        avg_nav = inv_total / shares
+
+    return shares * closes[ends], inv_total
+
+def run_walk_forward(output_dir, data, rows, horizon, quiet=False):
+    """
+    Evaluate dca and the given trials from every start date, save every outcome and the distribution
+    of gains, show and return the distribution
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows of the trials to evaluate, dca first
+    int horizon: Months invested from each start date, None to invest until the end
+    bool quiet: Disable verbosity
+    """
+
+    import numpy
+    import pandas
+
+    closes = data['Close'].to_numpy(dtype=float)
+    dates = pandas.to_datetime(data['Date']).dt.date.to_numpy()
+    starts, ends = get_start_dates(len(closes), horizon)
+
+    outcomes = {}
+    for row in rows:
+        if row[0] == 0:
+            value, inv_total = simulate_dca_start_dates(closes, starts, ends)
+        else:
+            value, inv_total = simulate_start_dates(
+                closes, starts, ends, *compile_tiers(row[7], row[8])
+            )
+        outcomes[row[0]] = (value, inv_total, (value * 100 / inv_total) - 100)
+
+    with open_output(os.path.join(output_dir, 'walk_forward.csv')) as results:
+        csv_res = csv.writer(results, delimiter=',')
+        csv_res.writerow(['Start Date', 'End Date', 'Trial', 'Value', 'Inv Total', 'Gain'])
+
+        for trial, (value, inv_total, gain) in outcomes.items():
+            csv_res.writerows(zip(
+                dates[starts], dates[ends], itertools.repeat(trial), value.tolist(),
+                inv_total.tolist(), gain.tolist()
+            ))
+
+    dca_gain = outcomes[0][2]
+    summary = []
+
+    for trial, (_, _, gain) in outcomes.items():
+        percentiles = numpy.percentile(gain, [0, 5, 25, 50, 75, 95, 100]).tolist()
+        beats = (gain > dca_gain).mean() * 100
+        summary.append([trial, len(gain), gain.mean(), *percentiles, beats])
+
+    with open_output(os.path.join(output_dir, 'walk_forward_summary.csv')) as results:
+        csv_res = csv.writer(results, delimiter=',')
+        csv_res.writerow([
+            'Trial', 'Start Dates', 'Mean Gain', 'Min Gain', 'P5 Gain', 'P25 Gain', 'Median Gain',
+            'P75 Gain', 'P95 Gain', 'Max Gain', 'Beats DCA'
+        ])
+        csv_res.writerows(summary)
+
+    if not quiet:
+        span = f'{horizon} months each' if horizon else 'until today'
+        print(f'\nWalk-forward: {len(starts)} start dates, {span}')
+        print(
+            f'{"<trial>":<10} {"<min>":>10} {"<p5>":>10} {"<median>":>10} {"<p95>":>10}'
+            f' {"<max>":>10} {"<beats dca>":>12}'
+        )
+
+        for row in summary:
+            trial = 'dca' if row[0] == 0 else f'[#{row[0]}]'
+            print(
+                f'{trial:<10} {row[3]:>9.2f}% {row[4]:>9.2f}% {row[6]:>9.2f}% {row[8]:>9.2f}% '
+                f'{row[9]:>9.2f}% {row[10]:>11.1f}%'
+            )
+
+    return summary
+
+def get_stress_paths(closes, count, model, block_size, rng):
+    """
+    Return simulated monthly close prices, one row per path, from the monthly returns of the asset
+
+    Parameters
+    ----------
+    numpy.ndarray closes: Monthly close prices
+    int count: Number of paths
+    str model: bootstrap to resample blocks of consecutive returns, gbm for a geometric brownian
+    motion
+    int block_size: Months in each bootstrapped block
+    numpy.random.Generator rng: Random number generator
+    """
+
+    import numpy
+
+    returns = numpy.diff(numpy.log(closes))
+    months = len(returns)
+
+    if model == 'gbm':
+        path_returns = rng.normal(returns.mean(), returns.std(ddof=1), (count, months))
+    else:
+        block_size = min(block_size, months)
+        blocks = -(-months // block_size)
+        starts = rng.integers(0, months - block_size + 1, (count, blocks))
+        indices = (starts[:, :, None] + numpy.arange(block_size)).reshape(count, -1)[:, :months]
+        path_returns = returns[indices]
+
+    log_closes = numpy.concatenate(
+        (numpy.zeros((count, 1)), numpy.cumsum(path_returns, axis=1)), axis=1
+    )
+
+    return closes[0] * numpy.exp(log_closes)
+
+def run_stress(config, output_dir, data, rows, seed):
+    """
+    Evaluate dca and the given trials on simulated price paths, a chunk of paths at a time, save
+    every outcome and the distribution of results, show and return the distribution
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    list rows: Mapper rows of the trials to evaluate, dca first
+    int seed: Seed of the price paths, None for a random one
+    """
+
+    import numpy
+
+    closes = data['Close'].to_numpy(dtype=float)
+    model = config.stress_model or 'bootstrap'
+    block_size = config.block_size or 12
+
+    if len(closes) < 3 or block_size < 1:
+        raise ValueError(
+            'Stress paths need at least 3 months of historical data and a positive block size!'
+        )
+
+    rng = numpy.random.default_rng(seed)
+    bounds, mults, mults_int = get_row_tiers(rows)
+
+    # paths x trials x months values are computed as one batch of trials per chunk of paths
+    chunk = max(1, stress_elements // (len(rows) * len(closes)))
+    outcomes = {
+        name: numpy.empty((config.stress, len(rows))) for name in ('value', 'gain', 'max_dd')
+    }
+
+    with open_output(os.path.join(output_dir, 'stress.csv')) as results:
+        csv_res = csv.writer(results, delimiter=',')
+        csv_res.writerow([
+            'Path', 'Trial', 'Value', 'Inv Total', 'Gain', 'All-time-high Drawdown', 'Max Drawdown',
+            'Time to Recovery'
+        ])
+
+        for start in range(0, config.stress, chunk):
+            count = min(chunk, config.stress - start)
+            paths = get_stress_paths(closes, count, model, block_size, rng)
+            paths = numpy.repeat(paths, len(rows), axis=0)
+
+            values, inv_total, _ = simulate_trials(
+                paths, numpy.tile(bounds, (count, 1)), numpy.tile(mults, (count, 1)),
+                numpy.tile(mults_int, (count, 1))
+            )
+            last_value, ath_dd, max_dd, ttr = get_batch_metrics(values)
+            gain = (last_value * 100 / inv_total) - 100
+
+            outcomes['value'][start:start + count] = last_value.reshape(count, len(rows))
+            outcomes['gain'][start:start + count] = gain.reshape(count, len(rows))
+            outcomes['max_dd'][start:start + count] = max_dd.reshape(count, len(rows))
+
+            csv_res.writerows(zip(
+                numpy.repeat(numpy.arange(start + 1, start + count + 1), len(rows)).tolist(),
+                [row[0] for row in rows] * count,
+                last_value.tolist(), inv_total.tolist(), gain.tolist(), ath_dd.tolist(),
+                max_dd.tolist(), ttr.tolist()
+            ))
+
+    summary = []
+    for i, row in enumerate(rows):
+        line = [row[0], config.stress]
+        for name in ('value', 'gain', 'max_dd'):
+            percentiles = numpy.percentile(outcomes[name][:, i], [5, 50, 95]).tolist()
+            line += [outcomes[name][:, i].mean(), *percentiles]
+        summary.append(line + [(outcomes['gain'][:, i] > outcomes['gain'][:, 0]).mean() * 100])
+
+    with open_output(os.path.join(output_dir, 'stress_summary.csv')) as results:
+        csv_res = csv.writer(results, delimiter=',')
+        csv_res.writerow([
+            'Trial', 'Paths', 'Mean Value', 'P5 Value', 'Median Value', 'P95 Value', 'Mean Gain',
+            'P5 Gain', 'Median Gain', 'P95 Gain', 'Mean Max Drawdown', 'P5 Max Drawdown',
+            'Median Max Drawdown', 'P95 Max Drawdown', 'Beats DCA'
+        ])
+        csv_res.writerows(summary)
+
+    if not config.quiet:
+        print(f'\nStress test: {config.stress} {model} paths of {len(closes)} months')
+        print(
+            f'{"<trial>":<10} {"<p5 gain>":>11} {"<median gain>":>14} {"<p95 gain>":>11}'
+            f' {"<median max dd>":>16} {"<beats dca>":>12}'
+        )
+
+        for line in summary:
+            trial = 'dca' if line[0] == 0 else f'[#{line[0]}]'
+            print(
+                f'{trial:<10} {line[7]:>10.2f}% {line[8]:>13.2f}% {line[9]:>10.2f}%'
+                f' {line[12]:>15.2f}% {line[14]:>11.1f}%'
+            )
+
+    return summary
+
+def load_grid(grid_path):
+    """
+    Load grid axes from a json file
+
+    Parameters
+    ----------
+    str grid_path: Path to the grid file
+    """
+
+    with open(grid_path, 'r', encoding='utf-8') as grid_file:
+        grid = json.load(grid_file)
+
+    if not isinstance(grid, dict) or not isinstance(grid.get('ranges'), dict):
+        raise ValueError('Invalid grid! Missing range boundaries')
+
+    if not isinstance(grid.get('multipliers', {}), dict):
+        raise ValueError('Invalid grid! Multipliers must map tiers to lists of values')
+
+    for tier in tiers[:-1]:
+        if not grid['ranges'].get(tier):
+            raise ValueError(f'Invalid grid! Missing range boundaries for {tier}')
+
+    axes = [('range boundaries', tier, values) for tier, values in grid['ranges'].items()]
+    axes += [('multipliers', tier, values) for tier, values in grid.get('multipliers', {}).items()]
+
+    for name, tier, values in axes:
+        if not isinstance(values, list) or not all(
+            isinstance(value, (int, float)) and not isinstance(value, bool) for value in values
+        ):
+            raise ValueError(f'Invalid grid! The {name} for {tier} must be a list of numbers')
+
+    return grid
+
+def get_monotonic_combinations(axes, increasing=True):
+    """
+    Lazily yield combinations of one value per axis, skipping those that are not monotonic
+
+    Parameters
+    ----------
+    list axes: Sorted values of each axis
+    bool increasing: Values must not decrease (True) or must not increase (False) along the axes
+    """
+
+    def combine(index, previous):
+        if index == len(axes):
+            yield ()
+            return
+
+        axis = axes[index]
+
+        if previous is None:
+            values = axis
+        elif increasing:
+            values = axis[bisect.bisect_left(axis, previous):]
+        else:
+            values = axis[:bisect.bisect_right(axis, previous)]
+
+        for value in values:
+            for rest in combine(index + 1, value):
+                yield (value,) + rest
+
+    return combine(0, None)
+
+def generate_grid(grid, mult_ls):
+    """
+    Check that the grid has at least one valid combination and return a lazy iterator over the
+    ranges and multipliers of every valid combination of the grid axes
+
+    Parameters
+    ----------
+    dict grid: Range boundaries and multipliers axes
+    dict mult_ls: Multipliers for the tiers without a multipliers axis
+    """
+
+    bound_axes = [sorted(set(grid['ranges'][tier])) for tier in tiers[:-1]]
+    mult_axes = [
+        sorted(set(grid.get('multipliers', {}).get(tier, [mult_ls[tier]]))) for tier in tiers
+    ]
+
+    for axes, increasing in ((bound_axes, True), (mult_axes, False)):
+        if next(get_monotonic_combinations(axes, increasing), None) is None:
+            raise ValueError('Invalid grid! No valid combination')
+
+    def combine():
+        for bounds in get_monotonic_combinations(bound_axes):
+            bounds = [-9999, *bounds, 9999]
+            ranges = {tier: [bounds[i], bounds[i+1]] for i, tier in enumerate(tiers)}
+
+            for mults in get_monotonic_combinations(mult_axes, increasing=False):
+                yield ranges, dict(zip(tiers, mults))
+
+    return combine()
+
+def get_shard(config):
+    """
+    Return index and number of shards from i/N, None when not sharding
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    """
+
+    if not config.shard:
+        return None
+
+    index, _, count = config.shard.partition('/')
+
+    if not (index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count)):
+        raise ValueError('Invalid shard! Use i/N, with i between 1 and N')
+
+    return int(index) - 1, int(count)
+
+def get_shard_range(trials, index, count):
+    """
+    Return first and last trial index of a shard, as a slice of all trials
+
+    Parameters
+    ----------
+    int trials: Number of trials
+    int index: Shard index, from 0
+    int count: Number of shards
+    """
+
+    return trials * index // count, trials * (index + 1) // count
+
+def get_blocks(trials, block, trial=1):
+    """
+    Split trials in blocks of consecutive trials
+
+    Parameters
+    ----------
+    iterable trials: Ranges and multipliers of each trial
+    int block: Number of trials in each block
+    int trial: Number of the first trial
+    """
+
+    trials = iter(trials)
+
+    while params_ls := list(itertools.islice(trials, block)):
+        yield trial, params_ls
+        trial += len(params_ls)
+
+class VectorRng:
+    """
+    Stand-in for random, drawing uniform values from a vector in the unit hypercube
+    """
+
+    def __init__(self, vector):
+        self.vector = iter(vector)
+
+    def uniform(self, lower, upper):
+        """
+        Return next value of the vector scaled between lower and upper
+
+        Parameters
+        ----------
+        float lower: Lower limit
+        float upper: Upper limit
+        """
+
+        return lower + (upper - lower) * next(self.vector)
+
+def get_objective(config):
+    """
+    Return weights of the results to maximize when optimizing
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    """
+
+    columns = {'value': 1, 'gain': 3, 'ath_dd': 4, 'max_dd': 5}
+    weights = {}
+
+    for item in (config.objective or 'value').split(','):
+        name, _, weight = item.partition('=')
+
+        if name.strip() not in columns:
+            raise ValueError(f'Invalid objective! Use a mix of {", ".join(columns)}')
+
+        weights[columns[name.strip()]] = float(weight) if weight else 1.0
+
+    return weights
+
+def run_optimizer(config, output_dir, data, mult_ls, budget, seed):
+    """
+    Search ranges and multipliers with differential evolution and yield the mapper rows and extended
+    metrics of each generation
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    dict mult_ls: List of defined multipliers, None to optimize multipliers too
+    int budget: Maximum number of evaluations
+    int seed: Seed of the optimizer, None for a random one
+    """
+
+    import numpy
+
+    weights = get_objective(config)
+    # trials of runs that can stop early are saved by the main process, up to the stopping trial
+    save = get_save_trials(config) is None and not config.patience
+    risk_free = (config.risk_free or 0) if config.extended_metrics else None
+    rng = numpy.random.default_rng(seed)
+
+    # up to six draws for the multipliers and seven for the ranges
+    dims = 13
+    size = min(budget, 20)
+    mutation, crossover = 0.7, 0.9
+
+    def evaluate(trial, vectors):
+        params = []
+        for vector in vectors:
+            vector_rng = VectorRng(vector)
+            multipliers = mult_ls or gen_multipliers(config, vector_rng)
+            params.append((generate_ranges_random(config, vector_rng), multipliers))
+
+        def run(run_params):
+            rows, values, contributions = run_smart_dca_batch(
+                trial, data, run_params, risk_free is not None
+            )
+
+            if risk_free is None:
+                return rows, None
+
+            return rows, get_values_metrics(values, contributions, risk_free)
+
+        if trial_cache.size:
+            rows, metrics = run_cached_trials(trial, params, get_kernel(config), run)
+            if risk_free is None:
+                metrics = None
+        else:
+            rows, metrics = run(params)
+
+        if save:
+            with instruments.timer('trial_files'):
+                save_trials(output_dir, data, rows)
+
+        scores = [sum(row[col] * w for col, w in weights.items()) for row in rows]
+        return rows, metrics, numpy.array(scores)
+
+    history_path = os.path.join(output_dir, 'optimizer.csv')
+    with open_output(history_path) as history:
+        csv.writer(history).writerow([
+            'Generation', 'Evaluations', 'Best Score', 'Mean Score', 'Best Trial'
+        ])
+
+    population = rng.random((size, dims))
+    rows, metrics, scores = evaluate(1, population)
+    trials = numpy.array([row[0] for row in rows])
+    evaluations, generation = size, 0
+
+    while True:
+        with open_output(history_path, 'a') as history:
+            best = scores.argmax()
+            csv.writer(history).writerow([
+                generation, evaluations, scores[best], scores.mean(), trials[best]
+            ])
+
+        yield rows, metrics
+
+        if evaluations >= budget:
+            break
+
+        count = min(size, budget - evaluations)
+        mutants = numpy.empty((count, dims))
+
+        for i in range(count):
+            picks = rng.choice(size - 1, 3, replace=False)
+            picks[picks >= i] += 1
+            difference = population[picks[1]] - population[picks[2]]
+            mutants[i] = population[picks[0]] + mutation * difference
+
+        cross = rng.random((count, dims)) < crossover
+        cross[numpy.arange(count), rng.integers(dims, size=count)] = True
+        candidates = numpy.where(cross, numpy.clip(mutants, 0, 1), population[:count])
+
+        rows, metrics, candidate_scores = evaluate(evaluations + 1, candidates)
+        improved = numpy.flatnonzero(candidate_scores >= scores[:count])
+
+        population[improved] = candidates[improved]
+        scores[improved] = candidate_scores[improved]
+        trials[improved] = [rows[i][0] for i in improved]
+
+        evaluations += count
+        generation += 1
+
+def run_blocks(config, output_dir, data, seed, blocks, workers):
+    """
+    Run blocks of trials, on a process pool if requested, and yield their mapper rows and extended
+    metrics in order
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory
+    pandas.DataFrame data: Historical data for selected asset
+    int seed: Base seed, None to use the global random state
+    iterable blocks: First trial and list of ranges and multipliers of each block
+    int workers: Number of worker processes
+    """
+
+    if workers <= 1:
+        for trial, params_ls in blocks:
+            yield run_trials(config, output_dir, trial, data, seed, params_ls)
+        return
+
+    def collect(job):
+        rows, metrics, snapshot = job.result()
+        instruments.merge(snapshot)
+        return rows, metrics
+
+    # forked workers would inherit the threads of the numba kernel and of concurrent downloads
+    context = multiprocessing.get_context('spawn')
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=context, initializer=init_worker, initargs=(config, data)
+    )
+
+    with pool:
+        jobs = collections.deque()
+
+        try:
+            for trial, params_ls in blocks:
+                jobs.append(pool.submit(run_worker_trials, output_dir, trial, seed, params_ls))
+
+                if len(jobs) > workers * 2:
+                    yield collect(jobs.popleft())
+
+            while jobs:
+                yield collect(jobs.popleft())
+        except GeneratorExit:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+def save_checkpoint(output_dir, checkpoint):
+    """
+    Save run state to checkpoint.pkl, replacing the previous checkpoint only once fully written
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    dict checkpoint: Run state
+    """
+
+    checkpoint_path = os.path.join(output_dir, 'checkpoint.pkl')
 
-            inv_monthly = 100 * multiplier
-            inv_total += inv_monthly
-            shares += inv_monthly / close
-            avg_nav = inv_total / shares
-            value = shares * close
+    with open_output(f'{checkpoint_path}.tmp', 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file)
+    os.replace(f'{checkpoint_path}.tmp', checkpoint_path)
 
-            csv_res.writerow([close, shares, value, inv_monthly, inv_total, avg_nav])
+def load_checkpoint(output_dir):
+    """
+    Load and validate run state from checkpoint.pkl
+
+    Parameters
+    ----------
+    str output_dir: Output directory of the run to resume
+    """
+
+    checkpoint_path = os.path.join(output_dir, 'checkpoint.pkl')
 
-    mapper(output_dir, trial, inv_total, ranges, multipliers)
+    if not os.path.isfile(checkpoint_path):
+        raise FileNotFoundError(f'No checkpoint found in {output_dir}!')
 
-def print_res(str_1, str_2, str_3, str_4='', mes=''):
+    with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+
+    if checkpoint['version'] != VERSION:
+        raise ValueError('Checkpoint was saved by a different version!')
+
+    if checkpoint['complete']:
+        raise ValueError(f'Run in {output_dir} is already complete!')
+
+    return checkpoint
+
+class Backtester:
     """
-    Print results in table format
+    Run dca and smart dca analysis of an asset, from the command line or from Python
 
     Parameters
     ----------
-    str str_1: String 1
-    str str_2: String 2
-    str str_3: String 3
-    str str_4: String 4
-    str mes: Unit of measurement
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory, None to define it from the settings
+
+    The progress attribute can be set to a function, called with the trials run and the trials to
+    run (None if unknown) after every block of trials.
     """
 
-    def space_1(string):
-        return ' ' * (25 - len(str(string)))
+    def __init__(self, config=None, output_dir=None):
+        self.config = config or BacktestConfig()
+        self.output_dir = output_dir or get_output_dir(self.config, self.config.asset)
+        self.start_date, self.data, self.dca = None, None, None
+        self.best, self.frontier, self.top_trials = {}, [], [[] for _ in range(5)]
+        self.rows, self.seed = [], None
+        self.walk_forward, self.stress, self.early_stop, self.checkpoint = None, None, None, None
+        self.counts = {}
+        self.progress = None
+
+    @classmethod
+    def from_checkpoint(cls, output_dir):
+        """
+        Return a backtester that continues an interrupted run when run
+
+        Parameters
+        ----------
+        str output_dir: Output directory of the run to resume
+        """
+
+        checkpoint = load_checkpoint(output_dir)
+
+        backtester = cls(BacktestConfig(**checkpoint['config']), output_dir)
+        backtester.start_date, backtester.data = checkpoint['start_date'], checkpoint['data']
+        backtester.checkpoint = checkpoint
+
+        return backtester
+
+    def load_data(self, data=None, start_date=None):
+        """
+        Load monthly historical data of the asset, return data
+
+        Parameters
+        ----------
+        pandas.DataFrame data: Monthly Date and Close columns, None to download them
+        datetime.date start_date: First day of historical data
+        """
+
+        import numpy
+
+        if data is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.start_date, self.data = get_data(self.config, self.config.asset, self.output_dir)
+        else:
+            import pandas
 
-    def space_2(string):
-        return ' ' * (20 - len(str(string)) - len(mes) + 1)
+            self.start_date = start_date or data['Date'].iloc[0]
+            self.data = pandas.DataFrame({
+                'Date': data['Date'].to_numpy(),
+                'Close': numpy.ascontiguousarray(data['Close'].to_numpy(dtype=float))
+            })
 
-    args = parse_arguments()
+        return self.data
 
-    if mes:
-        str_3 = f'[#{str_3}]'
+    def run_dca(self):
+        """
+        Run dca analysis on historical data, save its results, return its mapper row
+        """
 
-    if not args.quiet:
-        print(str_1, space_1(str_1), str_2, mes, space_2(str_2), str_3, str_4, mes)
+        config, output_dir = self.config, self.output_dir
+
+        if self.data is None:
+            self.load_data()
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        with instruments.timer('dca'):
+            self.dca = run_dca_analysis(output_dir, self.data)
+        append_results(config, output_dir, [self.dca])
+
+        self.best, self.frontier, self.top_trials = {}, [], [[] for _ in range(5)]
+        update_best_results(self.best, [self.dca])
+        self.rows = [self.dca]
+
+        if config.extended_metrics:
+            with instruments.timer('extended_metrics'):
+                append_extended_metrics(config, output_dir, self.data, [self.dca])
+
+        return self.dca
+
+    def save_state(self, trial, complete=False):
+        """
+        Save the run state after a trial to checkpoint.pkl
+
+        Parameters
+        ----------
+        int trial: Last trial saved to the results
+        bool complete: The run is complete and cannot be resumed
+        """
+
+        config, output_dir = self.config, self.output_dir
+        metrics_path = os.path.join(output_dir, 'metrics.csv')
+
+        save_checkpoint(output_dir, {
+            'version': VERSION, 'config': dataclasses.asdict(config), 'start_date': self.start_date,
+            'data': self.data, 'seed': self.seed,
+            'random_state': random.getstate() if self.seed is None else None, 'trial': trial,
+            'results_size': os.path.getsize(get_results_path(config, output_dir)),
+            'metrics_size': os.path.getsize(metrics_path) if os.path.isfile(metrics_path) else 0,
+            'best': self.best, 'frontier': self.frontier, 'top_trials': self.top_trials,
+            'early_stop': self.early_stop, 'complete': complete
+        })
+
+    def run_trials(self, keep_rows=True):
+        """
+        Run smart dca analysis on historical data, running dca first if needed, save results, return
+        best results
+
+        Parameters
+        ----------
+        bool keep_rows: Keep the mapper rows of every trial in memory, only new ones when resuming
+        """
+
+        config, output_dir, resume = self.config, self.output_dir, self.checkpoint
+
+        if self.data is None:
+            self.load_data()
+
+        data = self.data
+
+        if config.walk_forward:
+            get_start_dates(len(data), config.horizon)
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        trial_cache.setup(config, data)
+        hits, misses = (
+            instruments.counters.get(name, 0) for name in ('cache_hits', 'cache_misses')
+        )
+
+        keep = get_save_trials(config)
+        if keep != 0:
+            os.makedirs(os.path.join(output_dir, 'trials'), exist_ok=True)
+
+        if resume is None:
+            if self.dca is None:
+                self.run_dca()
+            if not keep_rows:
+                self.rows = []
+        else:
+            self.best, self.frontier = resume['best'], resume['frontier']
+            self.top_trials = resume['top_trials']
+            self.dca = self.best['dca']
+            self.rows = []
+
+        best, top_trials = self.best, self.top_trials
+
+        workers = config.workers or 1
+        seed = config.seed if resume is None else resume['seed']
+        shard = get_shard(config)
+
+        if workers > 1 and seed is None:
+            seed = random.randrange(2**32)
+
+        if shard and seed is None and (config.rand_mult or not (config.grid or config.incr_ranges)):
+            raise ValueError('Sharded runs of random trials need a seed!')
+
+        if shard and config.patience:
+            raise ValueError('Sharded runs cannot stop early!')
+
+        if resume is not None:
+            stopper = resume.get('early_stop')
+        elif config.patience:
+            stopper = EarlyStop(config.patience, config.min_delta or 0)
+        else:
+            stopper = None
 
-def get_results(output_dir):
+        self.seed, self.early_stop = seed, stopper
+
+        if not config.rand_mult:
+            mult_ls = gen_multipliers(config)
+        else:
+            mult_ls = None
+
+        if config.grid:
+            # the multipliers of the whole grid are drawn from the seed, so that every shard uses
+            # the same ones
+            grid_rng = random if seed is None else random.Random(seed)
+            grid_mult_ls = mult_ls or gen_multipliers(config, grid_rng)
+            trials = generate_grid(load_grid(config.grid), grid_mult_ls)
+            max_trials = None
+            if shard or config.patience:
+                max_trials = sum(1 for _ in generate_grid(load_grid(config.grid), grid_mult_ls))
+        elif not config.incr_ranges:
+            if config.trials:
+                max_trials = config.trials
+            else:
+                max_trials = 10000
+
+            trials = itertools.repeat((None, mult_ls), max_trials)
+        else:
+            i = 0
+            trials = []
+            while i <= 10:
+                trials.append((generate_ranges_incremental(i), mult_ls))
+                i += 0.5
+            max_trials = len(trials)
+
+        first = 0
+        if shard:
+            first, last = get_shard_range(max_trials, *shard)
+            trials = itertools.islice(trials, first, last)
+            max_trials = last - first
+
+        if workers > 1 and max_trials:
+            block = max(1, min(batch_size, -(-max_trials // (workers * 4))))
+        else:
+            block = batch_size
+
+        # at most patience - 1 trials are run past the stopping trial
+        if stopper:
+            block = min(block, stopper.patience)
+
+        metrics_path = os.path.join(output_dir, 'metrics.csv')
+
+        def add_rows(rows, metrics=None):
+            instruments.count('trials', len(rows))
+
+            with instruments.timer('best_results'):
+                update_best_results(best, rows)
+
+            with instruments.timer('pareto_frontier'):
+                self.frontier = update_pareto_frontier(self.frontier, rows)
+
+            if keep:
+                with instruments.timer('top_trials'):
+                    update_top_trials(top_trials, rows, keep)
+
+            if keep_rows:
+                self.rows.extend(rows)
+
+            if config.extended_metrics:
+                with instruments.timer('extended_metrics'):
+                    append_extended_metrics(config, output_dir, data, rows, metrics)
+
+        trial = first
+        trials = iter(trials)
+
+        if resume is not None:
+            trial = resume['trial']
+            collections.deque(itertools.islice(trials, trial - first), maxlen=0)
+
+            if resume['random_state'] is not None:
+                random.setstate(resume['random_state'])
+
+            if os.path.isfile(metrics_path):
+                with open(metrics_path, 'r+', encoding='utf-8') as metrics_file:
+                    metrics_file.truncate(resume.get('metrics_size', 0))
+
+            # trials completed after the last checkpoint are read back, only replaying their random
+            # draws
+            if config.results == 'binary':
+                rows = read_records_tail(output_dir, resume['results_size'], trial)
+            else:
+                rows = read_mapper_tail(output_dir, resume['results_size'], trial)
+            for i, (ranges, multipliers) in enumerate(itertools.islice(trials, len(rows))):
+                if seed is None:
+                    get_trial_params(config, trial + i + 1, seed, ranges, multipliers)
+
+            if stopper:
+                stopper.update(rows)
+
+            add_rows(rows)
+            trial += len(rows)
+
+        if stopper and stopper.reason:
+            results = []
+        elif config.optimize:
+            if shard:
+                raise ValueError('Optimization runs cannot be sharded!')
+            results = run_optimizer(config, output_dir, data, mult_ls, config.optimize, seed)
+        else:
+            self.save_state(trial)
+            blocks = get_blocks(trials, block, trial + 1)
+            results = run_blocks(config, output_dir, data, seed, blocks, workers)
+
+        checkpoint_time = time.monotonic()
+        discarded = 0
+
+        with instruments.timer('trial_loop'):
+            for rows, metrics in results:
+                if stopper:
+                    discarded += len(rows)
+                    rows = rows[:stopper.update(rows)]
+                    metrics = metrics and metrics[:len(rows)]
+                    discarded -= len(rows)
+
+                    if keep is None:
+                        with instruments.timer('trial_files'):
+                            save_trials(output_dir, data, rows)
+
+                with instruments.timer('mapper'):
+                    append_results(config, output_dir, rows)
+
+                add_rows(rows, metrics)
+                trial = rows[-1][0]
+
+                if self.progress:
+                    self.progress(trial - first, config.optimize or max_trials)
+
+                # results of worker processes are only cached in the workers
+                if trial_cache.path and workers > 1 and not config.optimize:
+                    for row, trial_metrics in zip(rows, metrics or itertools.repeat(())):
+                        key = get_trial_key(row[7], row[8], get_kernel(config))
+                        trial_cache.put(key, (*row[1:7], *trial_metrics))
+
+                if stopper and stopper.reason:
+                    # pending blocks of worker processes are discarded
+                    results.close()
+                    break
+
+                checkpoint_due = time.monotonic() - checkpoint_time >= checkpoint_interval
+
+                if not config.optimize and checkpoint_due:
+                    with instruments.timer('checkpoint'):
+                        self.save_state(trial)
+                    checkpoint_time = time.monotonic()
+
+        if keep:
+            with instruments.timer('trial_files'):
+                save_trials(output_dir, data, self.get_saved_rows())
+
+        self.counts = {
+            'first': first, 'last': trial, 'total': config.optimize or max_trials,
+            'discarded': discarded,
+            'cache_hits': instruments.counters.get('cache_hits', 0) - hits,
+            'cache_misses': instruments.counters.get('cache_misses', 0) - misses
+        }
+        trial_cache.save()
+
+        return best
+
+    def run(self, keep_rows=True):
+        """
+        Run dca and smart dca analysis on historical data, save and show results, return best
+        results
+
+        Parameters
+        ----------
+        bool keep_rows: Keep the mapper rows of every trial in memory, only new ones when resuming
+        """
+
+        config, output_dir = self.config, self.output_dir
+
+        best = self.run_trials(keep_rows)
+        data, dca, seed = self.data, self.dca, self.seed
+        stopper, counts = self.early_stop, self.counts
+        best_rows = list({
+            result[1][0]: result[1] for key, result in best.items() if key != 'dca'
+        }.values())
+
+        if not config.quiet:
+            print(f'Asset:      {config.asset}')
+            print(f'Start date: {self.start_date}')
+            if seed is not None:
+                print(f'Seed:       {seed}')
+            print()
+
+        with instruments.timer('results'):
+            get_results(output_dir, best, self.frontier, config.quiet)
+
+        if stopper and stopper.reason and not config.quiet:
+            saved = counts['last'] - counts['first']
+            print(f'\nStopped early at trial {counts["last"]}: {stopper.reason}')
+            if counts['total']:
+                not_run = counts['total'] - saved - counts['discarded']
+                print(f'Trials saved: {saved} of {counts["total"]}, '
+                      f'{counts["discarded"]} run past the stop, {not_run} not run')
+
+        hits, misses = counts['cache_hits'], counts['cache_misses']
+
+        if not config.quiet and hits + misses:
+            rate = hits * 100 / (hits + misses)
+            print(f'\nTrial cache: {hits} hits, {misses} misses ({rate:.1f}% hits)')
+
+        if config.extended_metrics and not config.quiet:
+            print_extended_metrics(config, data, [dca, *best_rows])
+
+        if config.walk_forward:
+            with instruments.timer('walk_forward'):
+                self.walk_forward = run_walk_forward(
+                    output_dir, data, [dca, *best_rows], config.horizon, config.quiet
+                )
+
+        if config.stress:
+            stress_rows = self.get_saved_rows() if get_save_trials(config) else best_rows
+            with instruments.timer('stress'):
+                self.stress = run_stress(config, output_dir, data, [dca, *stress_rows], seed)
+
+        if not config.optimize:
+            self.save_state(counts['last'], complete=True)
+
+        return best
+
+    def get_saved_rows(self):
+        """
+        Return the mapper rows of the top and best trials, sorted by trial
+        """
+
+        saved_rows = {trial: row for heap in self.top_trials for _, trial, row in heap}
+        saved_rows.update({
+            result[1][0]: result[1] for key, result in self.best.items() if key != 'dca'
+        })
+
+        return [saved_rows[trial] for trial in sorted(saved_rows)]
+
+    def get_results_records(self):
+        """
+        Return the mapper rows kept by run, dca first, as a numpy structured array of result_fields
+        """
+
+        return get_records(self.rows)
+
+    def get_results_frame(self):
+        """
+        Return the mapper rows kept by run, dca first, as a pandas.DataFrame
+        """
+
+        import pandas
+
+        return pandas.DataFrame(self.rows, columns=header)
+
+def run_assets(config, assets):
     """
-    Process, save, and show best results
+    Download historical data of several assets concurrently, analyze each one as soon as its data
+    is available, and save and show a summary of all of them
 
     Parameters
     ----------
-    str output_dir: Output directory
+    BacktestConfig config: Backtest settings
+    list assets: Assets to analyze
     """
 
-    best_value = best_gain = best_ath_dd = best_max_dd = best_ttr = None
+    output_root = get_output_dir(config, 'assets')
+    summary = {}
 
-    with open(os.path.join(output_dir, 'mapper.csv'), 'r', encoding='utf-8') as map_file:
-        for line in csv.reader(map_file):
+    def fetch(asset):
+        output_dir = os.path.join(output_root, asset)
+        os.makedirs(output_dir, exist_ok=True)
+        return output_dir, *get_data(config, asset, output_dir)
+
+    with concurrent.futures.ThreadPoolExecutor(fetch_workers) as pool:
+        jobs = {pool.submit(fetch, asset): asset for asset in assets}
+
+        for job in concurrent.futures.as_completed(jobs):
+            asset = jobs[job]
+
+            # yfinance raises plain exceptions for unknown or delisted assets, which must not stop
+            # the others
             try:
-                if int(line[0]) == 0:
-                    dca = line
-                else:
-                    if best_value is None or float(line[1]) >= best_value:
-                        best_value = round(float(line[1]), 2)
-                        value_line = line
-
-                    if best_gain is None or float(line[3]) >= best_gain:
-                        best_gain = round(float(line[3]), 2)
-                        gain_line = line
-
-                    if best_ath_dd is None or float(line[4]) <= best_ath_dd:
-                        best_ath_dd = round(float(line[4]), 2)
-                        ath_dd_line = line
-
-                    if best_max_dd is None or float(line[5]) <= best_max_dd:
-                        best_max_dd = round(float(line[5]), 2)
-                        max_dd_line = line
-
-                    if best_ttr is None or float(line[6]) <= best_ttr:
-                        best_ttr = int(line[6])
-                        ttr_line = line
-            except ValueError:
-                pass
-
-    with open(os.path.join(output_dir, 'best_results.csv'), 'a', encoding='utf-8') as results:
-        results = csv.writer(results, delimiter=',')
-        results.writerow(header)
-        results.writerow(dca)
-        results.writerow(value_line)
-        results.writerow(gain_line)
-        results.writerow(ath_dd_line)
-        results.writerow(max_dd_line)
-        results.writerow(ttr_line)
+                output_dir, start_date, data = job.result()
+            except Exception as error:
+                summary[asset] = [asset, None] + [None] * 9 + [str(error)]
+                continue
+
+            if not config.quiet:
+                print('\n' + '-' * 75)
+
+            # other downloads are still running, trial workers are spawned so they do not copy them
+            backtester = Backtester(dataclasses.replace(config, asset=asset), output_dir)
+            backtester.load_data(data, start_date)
+            best = backtester.run(keep_rows=False)
+            dca = best['dca']
+
+            summary[asset] = [
+                asset, start_date,
+                dca[1], best['value'][1][1], best['value'][1][0],
+                dca[3], best['gain'][1][3], best['gain'][1][0],
+                dca[5], best['max_dd'][1][5], best['max_dd'][1][0],
+                None
+            ]
+
+    with open_output(os.path.join(output_root, 'summary.csv')) as summary_file:
+        csv_summary = csv.writer(summary_file, delimiter=',')
+        csv_summary.writerow([
+            'Asset', 'Start Date', 'DCA Value', 'Best Value', 'Best Value Trial', 'DCA Gain',
+            'Best Gain', 'Best Gain Trial', 'DCA Max Drawdown', 'Best Max Drawdown',
+            'Best Max Drawdown Trial', 'Error'
+        ])
+        csv_summary.writerows(summary[asset] for asset in assets)
+
+    if not config.quiet:
+        print('\n' + '-' * 75)
+        print(
+            f'{"<asset>":<12} {"<start>":<12} {"<dca gain>":>12} {"<best gain>":>12}'
+            f' {"<dca max dd>":>13} {"<best max dd>":>14}'
+        )
+
+        for asset in assets:
+            row = summary[asset]
+            if row[-1]:
+                print(f'{asset:<12} {row[-1]}')
+            else:
+                print(
+                    f'{asset:<12} {str(row[1]):<12} {row[5]:>11.2f}% {row[6]:>11.2f}%'
+                    f' {row[8]:>12.2f}% {row[9]:>13.2f}%'
+                )
+
+def merge_metrics(output_dir, shards):
+    """
+    Merge the extended metrics of sharded runs, if every shard saved them, renumbering trials
+
+    Parameters
+    ----------
+    str output_dir: Output directory of the merged results
+    list shards: Directory, first and last trial, and merged first and last trial of each shard
+    """
 
-    print_res('<stat>', '<dca>', '<smart dca trial>')
-    print_res('Value', round(float(dca[1]), 2), value_line[0], best_value, '$')
-    print_res('Gain', int(float(dca[3])), gain_line[0], best_gain, '%')
-    print_res('All-time-high drawdown', round(float(dca[4]), 2), ath_dd_line[0], best_ath_dd, '%')
-    print_res('Max drawdown ', round(float(dca[5]), 2), max_dd_line[0], best_max_dd, '%')
-    print_res('Time to recovery', int(dca[6]), ttr_line[0], best_ttr, 'months')
+    if not all(os.path.isfile(os.path.join(shard[0], 'metrics.csv')) for shard in shards):
+        return
 
-def main():
+    with open_output(os.path.join(output_dir, 'metrics.csv')) as metrics_file:
+        csv_metrics = csv.writer(metrics_file, delimiter=',')
+
+        for i, (shard_dir, first, _, merged_first, _) in enumerate(shards):
+            with open(os.path.join(shard_dir, 'metrics.csv'), 'r', encoding='utf-8') as shard_file:
+                shard_metrics = csv.reader(shard_file)
+                metrics_header = next(shard_metrics)
+
+                if i == 0:
+                    csv_metrics.writerow(metrics_header)
+
+                for row in shard_metrics:
+                    if int(row[0]) == 0:
+                        if i == 0:
+                            csv_metrics.writerow(row)
+                        continue
+
+                    csv_metrics.writerow([int(row[0]) - first + merged_first, *row[1:]])
+
+def merge_shards(config, output_dir, shard_dirs):
     """
-    Main function
+    Merge the results of sharded runs one block at a time, renumbering trials, then save and show
+    best results of all shards, return best results
+
+    Parameters
+    ----------
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory of the merged results
+    list shard_dirs: Output directories of the shards, in order
     """
 
-    args = parse_arguments()
+    if os.path.exists(get_results_path(config, output_dir)):
+        raise ValueError(f'{output_dir} already contains results!')
 
-    run_checks()
+    os.makedirs(output_dir, exist_ok=True)
 
-    start_time = time.monotonic()
+    best, frontier, dca, trial, shards = {}, [], None, 0, []
 
-    asset = get_asset()
+    for shard_dir in shard_dirs:
+        checkpoint_path = os.path.join(shard_dir, 'checkpoint.pkl')
+        if os.path.isfile(checkpoint_path):
+            with open(checkpoint_path, 'rb') as checkpoint_file:
+                if not pickle.load(checkpoint_file)['complete']:
+                    raise ValueError(f'Shard {shard_dir} is not complete!')
 
-    output_dir = get_output_dir(asset)
+        shard = [shard_dir, None, None, trial + 1, None]
 
-    if not os.path.isdir(output_dir):
-        os.makedirs(os.path.join(output_dir, 'trials'))
+        for rows in read_results_blocks(shard_dir):
+            if rows[0][0] == 0:
+                shard_dca, rows = rows[0], rows[1:]
 
-    dl_start = time.monotonic()
-    start_date, data = get_data(asset, output_dir)
-    dl_end = time.monotonic()
+                if dca is None:
+                    dca = shard_dca
+                    append_results(config, output_dir, [dca])
+                    update_best_results(best, [dca])
+                    shutil.copyfile(get_trial_path(shard_dir, 0), get_trial_path(output_dir, 0))
+                elif shard_dca != dca:
+                    raise ValueError(f'Shard {shard_dir} was run on different historical data!')
 
-    run_dca_analysis(output_dir, data)
+                if not rows:
+                    continue
 
-    analysis_start = time.monotonic()
-    trial = 1
+            shard[1] = shard[1] or rows[0][0]
+            shard[2] = rows[-1][0]
 
-    if not args.rand_mult:
-        mult_ls = gen_multipliers()
-    else:
-        mult_ls = None
+            for row in rows:
+                trial += 1
+                row[0] = trial
 
-    if not args.incr_ranges:
-        if args.trials:
-            max_trials = args.trials
+            append_results(config, output_dir, rows)
+            update_best_results(best, rows)
+            frontier = update_pareto_frontier(frontier, rows)
+
+        shard[4] = trial
+        shards.append(shard)
+
+    merge_metrics(output_dir, shards)
+
+    with open_output(os.path.join(output_dir, 'shards.csv')) as shards_file:
+        csv_shards = csv.writer(shards_file, delimiter=',')
+        csv_shards.writerow([
+            'Shard', 'First Trial', 'Last Trial', 'Merged First Trial', 'Merged Last Trial'
+        ])
+        csv_shards.writerows(shards)
+
+    if not config.quiet:
+        print(f'Merged {trial} trials from {len(shard_dirs)} shards')
+        print()
+
+    get_results(output_dir, best, frontier, config.quiet)
+
+    return best
+
+def init_service_worker(progress):
+    """
+    Store the progress queue of the service and warm up a worker process, importing pandas and
+    compiling the simulation before the first job
+
+    Parameters
+    ----------
+    multiprocessing.Queue progress: Queue of (job id, trials run, trials to run) tuples
+    """
+
+    import numpy
+
+    global service_progress
+    service_progress = progress
+
+    importlib.import_module('pandas')
+    if has_numba:
+        simulate_trials_numba(
+            numpy.ones(3), numpy.zeros((1, 6)), numpy.ones((1, 7)), numpy.ones((1, 7), dtype=bool),
+            numpy.ones((1, 3))
+        )
+
+def get_row_result(row):
+    """
+    Return a mapper row as a dict
+
+    Parameters
+    ----------
+    list row: Mapper row
+    """
+
+    names = [
+        'trial', 'value', 'inv_total', 'gain', 'ath_dd', 'max_dd', 'ttr', 'ranges', 'multipliers'
+    ]
+
+    return dict(zip(names, row))
+
+def run_service_job(job_id, config, output_dir, data, start_date):
+    """
+    Run a backtest job in a worker process of the service, reporting its progress, and return its
+    results
+
+    Parameters
+    ----------
+    int job_id: Job id
+    BacktestConfig config: Backtest settings
+    str output_dir: Output directory of the job
+    pandas.DataFrame data: Historical data for selected asset
+    datetime.date start_date: First day of historical data
+    """
+
+    instruments.reset()
+    service_progress.put((job_id, 0, None))
+
+    backtester = Backtester(config, output_dir)
+    backtester.load_data(data, start_date)
+    backtester.progress = lambda trials, total: service_progress.put((job_id, trials, total))
+    best = backtester.run(keep_rows=False)
+
+    return {
+        'asset': config.asset,
+        'start_date': str(backtester.start_date),
+        'seed': backtester.seed,
+        'output_dir': output_dir,
+        'best': {
+            key: get_row_result(result if key == 'dca' else result[1])
+            for key, result in best.items()
+        },
+        'frontier': [row[0] for row in backtester.frontier],
+        'early_stop': backtester.early_stop.reason if backtester.early_stop else None,
+        'walk_forward': backtester.walk_forward,
+        'stress': backtester.stress,
+        'trials_per_sec': instruments.get_trials_per_sec()
+    }
+
+class BacktestService:
+    """
+    Queue of backtest jobs run by a pool of worker processes, which keep modules, the compiled
+    simulation and cached trial results in memory between jobs, on historical data kept in memory by
+    the service
+
+    Parameters
+    ----------
+    BacktestConfig config: Default settings of the jobs
+    str root: Directory of the output directories of the jobs
+    int jobs: Jobs to run at the same time
+    int queue: Jobs waiting to run before new ones are refused
+    """
+
+    def __init__(self, config, root, jobs=1, queue=100):
+        self.config = dataclasses.replace(
+            config, assets=None, workers=1, quiet=True, save_trials=config.save_trials or 'none'
+        )
+        self.root, self.size, self.queue = root, jobs, queue
+        self.jobs, self.data = {}, {}
+        self.ids = itertools.count(1)
+        self.changed = threading.Condition()
+        self.data_lock, self.asset_locks = threading.Lock(), {}
+
+        context = multiprocessing.get_context('spawn')
+        self.progress = context.Queue()
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            jobs, mp_context=context, initializer=init_service_worker, initargs=(self.progress,)
+        )
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def get_job_config(self, params):
+        """
+        Return the settings of a job, from the default settings and the ones sent with the job
+
+        Parameters
+        ----------
+        dict params: Settings sent with the job, named as BacktestConfig fields
+        """
+
+        if not isinstance(params, dict):
+            raise ValueError('Invalid job! Send a json object of settings')
+
+        fields = {field.name: field.type for field in dataclasses.fields(BacktestConfig)}
+
+        for name, value in params.items():
+            if name not in fields or name in service_excluded:
+                raise ValueError(f'Invalid job setting {name}!')
+
+            expected = (int, float) if fields[name] is float else fields[name]
+
+            if value is not None and not isinstance(value, expected):
+                raise ValueError(f'Invalid value of {name}! Expected {fields[name].__name__}')
+
+            if value is not None and name in setting_choices and value not in setting_choices[name]:
+                raise ValueError(f'Invalid value of {name}! Use {", ".join(setting_choices[name])}')
+
+        config = dataclasses.replace(self.config, **params)
+        get_save_trials(config)
+        get_objective(config)
+
+        return config
+
+    def get_data(self, config):
+        """
+        Return start date and monthly historical data of the asset of a job, loading them once a day
+
+        Parameters
+        ----------
+        BacktestConfig config: Backtest settings
+        """
+
+        key = (config.asset, config.period, datetime.date.today())
+
+        with self.data_lock:
+            self.data = {item: data for item, data in self.data.items() if item[2] == key[2]}
+            asset_lock = self.asset_locks.setdefault(config.asset, threading.Lock())
+
+        # jobs of other assets do not wait for the download, periods of an asset share its cached
+        # history
+        with asset_lock:
+            with self.data_lock:
+                data = self.data.get(key)
+
+            if data is None:
+                data = get_data(config, config.asset, self.root)
+
+                with self.data_lock:
+                    self.data[key] = data
+
+        return data
+
+    def submit(self, params):
+        """
+        Queue a job and return its state, None if the queue is full
+
+        Parameters
+        ----------
+        dict params: Settings sent with the job, named as BacktestConfig fields
+        """
+
+        config = self.get_job_config(params)
+
+        # the job takes its place in the queue before loading its data, which can take a while
+        with self.changed:
+            active = sum(job['status'] in ('queued', 'running') for job in self.jobs.values())
+
+            if active >= self.size + self.queue:
+                return None
+
+            job_id = next(self.ids)
+            self.jobs[job_id] = {
+                'id': job_id, 'status': 'queued', 'settings': params, 'trials': 0, 'total': None,
+                'result': None, 'error': None
+            }
+
+            finished = [
+                item for item, job in self.jobs.items() if job['status'] in ('done', 'failed')
+            ]
+            for item in finished[:max(0, len(self.jobs) - service_history)]:
+                del self.jobs[item]
+
+            job = dict(self.jobs[job_id])
+
+        try:
+            start_date, data = self.get_data(config)
+        except Exception:
+            with self.changed:
+                del self.jobs[job_id]
+                self.changed.notify_all()
+            raise
+
+        output_dir = os.path.join(self.root, 'jobs', str(job_id))
+        future = self.pool.submit(run_service_job, job_id, config, output_dir, data, start_date)
+        future.add_done_callback(lambda future: self.finish(job_id, future))
+
+        return job
+
+    def listen(self):
+        """
+        Update the progress of the jobs from the worker processes, until None is received
+        """
+
+        for job_id, trials, total in iter(self.progress.get, None):
+            with self.changed:
+                job = self.jobs.get(job_id)
+
+                if job is not None and job['status'] in ('queued', 'running'):
+                    job.update(status='running', trials=trials, total=total)
+                    self.changed.notify_all()
+
+    def finish(self, job_id, future):
+        """
+        Save the results, or the error, of a finished job
+
+        Parameters
+        ----------
+        int job_id: Job id
+        concurrent.futures.Future future: Future of the job
+        """
+
+        with self.changed:
+            job = self.jobs[job_id]
+
+            if future.cancelled():
+                job['status'], job['error'] = 'failed', 'Cancelled!'
+            elif future.exception() is not None:
+                error = future.exception()
+                job['status'], job['error'] = 'failed', f'{type(error).__name__}: {error}'
+            else:
+                job['status'], job['result'] = 'done', future.result()
+
+            self.changed.notify_all()
+
+    def get_job(self, job_id, wait=False):
+        """
+        Return the state of a job, None if unknown
+
+        Parameters
+        ----------
+        int job_id: Job id
+        bool wait: Wait until the job is finished
+        """
+
+        with self.changed:
+            if wait:
+                self.changed.wait_for(
+                    lambda: job_id not in self.jobs
+                    or self.jobs[job_id]['status'] in ('done', 'failed')
+                )
+
+            return dict(self.jobs[job_id]) if job_id in self.jobs else None
+
+    def get_updates(self, job_id):
+        """
+        Yield the state of a job every time it changes, until it is finished
+
+        Parameters
+        ----------
+        int job_id: Job id
+        """
+
+        job = None
+
+        while job is None or job['status'] not in ('done', 'failed'):
+            with self.changed:
+                self.changed.wait_for(lambda: self.jobs.get(job_id) != job, timeout=15)
+                job = dict(self.jobs[job_id]) if job_id in self.jobs else None
+
+            if job is None:
+                return
+
+            yield job
+
+    def close(self):
+        """
+        Cancel queued jobs, wait for running ones, and stop the worker processes
+        """
+
+        self.pool.shutdown(cancel_futures=True)
+        self.progress.put(None)
+        self.listener.join()
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Http json interface of a BacktestService, stored as the service attribute of the server:
+
+    GET  /health               service status
+    GET  /jobs                 state of every job, without results
+    POST /jobs[?wait=1]        queue a job, optionally waiting for its results
+    GET  /jobs/<id>            state and results of a job
+    GET  /jobs/<id>/events     state of a job every time it changes, one json object per line
+    """
+
+    def log_message(self, message, *args):
+        """
+        Log a request, unless the service is quiet
+
+        Parameters
+        ----------
+        str message: Message format
+        tuple args: Message arguments
+        """
+
+        if self.server.verbose:
+            super().log_message(message, *args)
+
+    def send_json(self, status, body):
+        """
+        Send a json response
+
+        Parameters
+        ----------
+        int status: Http status code
+        object body: Response body
+        """
+
+        payload = json.dumps(body, default=lambda value: value.item()).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def get_path(self):
+        """
+        Return path components and query parameters of the request
+        """
+
+        url = urllib.parse.urlsplit(self.path)
+
+        return url.path.strip('/').split('/'), dict(urllib.parse.parse_qsl(url.query))
+
+    def do_GET(self):
+        """
+        Return the status of the service, or the state of jobs
+        """
+
+        service = self.server.service
+        path, _ = self.get_path()
+
+        if path == ['health']:
+            with service.changed:
+                statuses = collections.Counter(job['status'] for job in service.jobs.values())
+            self.send_json(200, {'status': 'ok', 'version': VERSION, 'jobs': statuses})
+            return
+
+        if path == ['jobs']:
+            with service.changed:
+                jobs = [{**job, 'result': None} for job in service.jobs.values()]
+            self.send_json(200, jobs)
+            return
+
+        if (len(path) not in (2, 3) or path[0] != 'jobs' or not path[1].isdigit()
+                or path[2:] not in ([], ['events'])):
+            self.send_json(404, {'error': 'Not found!'})
+            return
+
+        job_id = int(path[1])
+        if service.get_job(job_id) is None:
+            self.send_json(404, {'error': f'Job {job_id} not found!'})
+            return
+
+        if len(path) == 2:
+            self.send_json(200, service.get_job(job_id))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        for job in service.get_updates(job_id):
+            self.wfile.write(json.dumps(job, default=lambda value: value.item()).encode() + b'\n')
+            self.wfile.flush()
+
+    def do_POST(self):
+        """
+        Queue a job from the json settings in the request body
+        """
+
+        service = self.server.service
+        path, query = self.get_path()
+
+        if path != ['jobs']:
+            self.send_json(404, {'error': 'Not found!'})
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            params = json.loads(body or b'{}')
+            job = service.submit(params)
+        except (ValueError, FileNotFoundError, OSError, KeyError) as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        if job is None:
+            self.send_json(503, {'error': 'Too many jobs, retry later!'})
+            return
+
+        if query.get('wait') in ('1', 'true'):
+            self.send_json(200, service.get_job(job['id'], wait=True))
         else:
-            max_trials = 10000
+            self.send_json(202, job)
+
+def run_service(config, host, port, jobs, queue):
+    """
+    Run backtest jobs sent to a local http json service, until interrupted
+
+    Parameters
+    ----------
+    BacktestConfig config: Default settings of the jobs
+    str host: Address to listen on
+    int port: Port to listen on
+    int jobs: Jobs to run at the same time
+    int queue: Jobs waiting to run before new ones are refused
+    """
+
+    root = config.output or tempfile.mkdtemp(prefix='smart-dca-backtest-')
+    service = BacktestService(config, root, jobs, queue)
+
+    server = http.server.ThreadingHTTPServer((host, port), ServiceHandler)
+    server.service, server.verbose = service, not config.quiet
+
+    if not config.quiet:
+        print(f'Serving backtests on http://{host}:{server.server_port}, saving jobs to {root}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+def run_backtest(args, config):
+    """
+    Run the backtest of one or more assets, and show execution time if requested
+
+    Parameters
+    ----------
+    argparse.Namespace args: Parsed arguments
+    BacktestConfig config: Backtest settings
+    """
+
+    start_time = time.monotonic()
 
-        while trial <= max_trials:
-            asyncio.run(run_smart_dca_analysis(output_dir, trial, data, mult_ls))
-            trial += 1
+    if args.command == 'merge':
+        merge_shards(config, args.output, args.shards)
+        return
+
+    if args.command == 'export':
+        export_results(args.output, args.path)
+        return
+
+    if args.command == 'serve':
+        run_service(config, args.host, args.port, args.jobs, args.queue)
+        return
+
+    if config.assets and not args.resume:
+        run_assets(config, config.assets)
+
+        if args.time:
+            print('\n' + '-' * 75)
+            elapsed = datetime.timedelta(seconds=time.monotonic() - start_time)
+            print(f'Total execution time: {elapsed}')
+            print()
+            instruments.print_stages()
+        return
+
+    if args.resume:
+        backtester = Backtester.from_checkpoint(args.resume)
+        if args.quiet:
+            backtester.config = dataclasses.replace(backtester.config, quiet=True)
     else:
-        i = 0
-        while i <= 10:
-            ranges = generate_ranges_incremental(i)
-            asyncio.run(run_smart_dca_analysis(output_dir, trial, data, mult_ls, ranges=ranges))
-            i += 0.5
-            trial += 1
-    analysis_end = time.monotonic()
+        backtester = Backtester(config)
 
-    if not args.quiet:
-        print(f'Asset:      {asset}')
-        print(f'Start date: {start_date}\n')
+    dl_start = time.monotonic()
+    if backtester.data is None:
+        backtester.load_data()
+    dl_end = time.monotonic()
 
-    get_results(output_dir)
+    analysis_start = time.monotonic()
+    backtester.run(keep_rows=False)
+    analysis_end = time.monotonic()
 
     if args.time:
         print('\n' + '-' * 75)
         print(f'Download time: {datetime.timedelta(seconds=dl_end-dl_start)}')
         print(f'Analysis time:  {datetime.timedelta(seconds=analysis_end-analysis_start)}')
         print(f'Total execution time: {datetime.timedelta(seconds=time.monotonic()-start_time)}')
+        print()
+        instruments.print_stages()
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+
+    run_checks(args)
+
+    config = get_config(args)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run_backtest, args, config)
+        profiler.dump_stats(args.profile)
+    else:
+        run_backtest(args, config)
+
+    if args.metrics:
+        instruments.save(args.metrics)
 
 if __name__ == '__main__':
     main()
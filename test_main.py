@@ -0,0 +1,756 @@
+#!/bin/python3
+
+"""
+"Smart DCA backtest" - Smart Dollar Cost Averaging backtest
+Copyright (C) 2022-2023 Andrea Varesio <https://www.andreavaresio.com/>
+Source Code: <https://github.com/andrea-varesio/smart-dca-backtest>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import dataclasses
+import http.server
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import numpy
+import pandas
+
+import main as backtest
+
+def gen_data(months, seed, crash=None):
+    """
+    Generate monthly prices following a geometric brownian motion
+
+    Parameters
+    ----------
+    int months: Length of the history in months
+    int seed: Seed of the generator
+    float crash: Fall of the last month, None to keep it random
+    """
+
+    rng = numpy.random.default_rng(seed)
+    closes = 100 * numpy.exp(numpy.cumsum(rng.normal(0.005, 0.05, months)))
+
+    if crash is not None:
+        closes[-1] = closes[:-1].min() * (1 - crash)
+
+    return pandas.DataFrame({'Close': closes})
+
+def gen_history(months, seed):
+    """
+    Generate monthly prices following a geometric brownian motion, with their dates
+
+    Parameters
+    ----------
+    int months: Length of the history in months
+    int seed: Seed of the generator
+    """
+
+    data = gen_data(months, seed)
+    data['Date'] = pandas.date_range('2000-01-01', periods=months, freq='MS')
+
+    return data
+
+def read_files(output_dir, names):
+    """
+    Return the contents of output files, by name
+
+    Parameters
+    ----------
+    str output_dir: Output directory
+    list names: Names of the files
+    """
+
+    contents = {}
+
+    for name in names:
+        with open(os.path.join(output_dir, name), 'rb') as output_file:
+            contents[name] = output_file.read()
+
+    return contents
+
+class TestBatchMetrics(unittest.TestCase):
+    """
+    Batch metrics must match the metrics of a single trial
+    """
+
+    def test_last_month_drawdown(self):
+        """
+        The deepest drawdown falls in the last month
+        """
+
+        data = gen_data(60, 1, crash=0.7)
+        config = backtest.BacktestConfig(seed=1)
+        params = [backtest.get_trial_params(config, trial, 1) for trial in range(1, 51)]
+
+        rows, _, _ = backtest.run_smart_dca_batch(1, data, params)
+
+        for row, (ranges, multipliers) in zip(rows, params):
+            expected = backtest.run_smart_dca_analysis(
+                None, row[0], data, multipliers, ranges=ranges, save=False
+            )
+            numpy.testing.assert_allclose(row[1:7], expected[1:7])
+            self.assertLess(row[5], -50)
+
+class TestKernels(unittest.TestCase):
+    """
+    Every simulation must match the reference analysis of a single trial
+    """
+
+    data = gen_data(240, 2)
+
+    def get_params(self, config, incremental=False):
+        """
+        Return ranges and multipliers of the trials of a run
+
+        Parameters
+        ----------
+        BacktestConfig config: Backtest settings
+        bool incremental: Use incremental ranges instead of random ones
+        """
+
+        if incremental:
+            mult_ls = backtest.gen_multipliers(config)
+            return [(backtest.generate_ranges_incremental(i / 2), mult_ls) for i in range(21)]
+
+        mult_ls = None if config.rand_mult else backtest.gen_multipliers(config)
+        return [
+            backtest.get_trial_params(config, trial, 1, None, mult_ls) for trial in range(1, 201)
+        ]
+
+    def check_kernels(self, params):
+        """
+        Compare the rows of every simulation with the reference analysis
+
+        Parameters
+        ----------
+        list params: Trial ranges and multipliers, as (ranges, multipliers) tuples
+        """
+
+        closes = self.data['Close'].to_numpy(dtype=float)
+        compiled = [backtest.compile_tiers(ranges, mp_ls) for ranges, mp_ls in params]
+        bounds = numpy.array([trial_bounds for trial_bounds, _ in compiled], dtype=float)
+        mults = numpy.array([trial_mults for _, trial_mults in compiled], dtype=float)
+        mults_int = numpy.array([
+            [isinstance(mult, int) for mult in trial_mults] for _, trial_mults in compiled
+        ])
+
+        expected_contributions = []
+        expected = numpy.array([
+            backtest.run_smart_dca_analysis(
+                None, trial, self.data, mp_ls, ranges=ranges, save=False,
+                trial_contributions=expected_contributions
+            )[1:7]
+            for trial, (ranges, mp_ls) in enumerate(params, 1)
+        ], dtype=float)
+
+        kernels = {
+            'numpy': backtest.simulate_trials,
+            'kernel': lambda *arrays: backtest.simulate_trials_numba(
+                *arrays, kernel=backtest.simulate_trials_kernel
+            )
+        }
+        if backtest.has_numba:
+            kernels['numba'] = backtest.simulate_trials_numba
+
+        for name, kernel in kernels.items():
+            with self.subTest(kernel=name):
+                contributions = numpy.empty((len(params), len(closes)))
+                values, inv_total, _ = kernel(closes, bounds, mults, mults_int, contributions)
+                last_value, ath_dd, max_dd, ttr = backtest.get_batch_metrics(values)
+                gain = (last_value * 100 / inv_total) - 100
+                rows = numpy.column_stack([last_value, inv_total, gain, ath_dd, max_dd, ttr])
+                numpy.testing.assert_allclose(rows, expected, rtol=1e-9, atol=1e-9)
+                numpy.testing.assert_array_equal(contributions, expected_contributions)
+
+    def test_random(self):
+        """
+        Seeded random ranges
+        """
+
+        self.check_kernels(self.get_params(backtest.BacktestConfig(seed=1)))
+
+    def test_random_multipliers(self):
+        """
+        Seeded random ranges and multipliers
+        """
+
+        self.check_kernels(self.get_params(backtest.BacktestConfig(seed=1, rand_mult=True)))
+
+    def test_incremental(self):
+        """
+        Incremental ranges
+        """
+
+        config = backtest.BacktestConfig(incr_ranges=True)
+        self.check_kernels(self.get_params(config, incremental=True))
+
+class TestDownload(unittest.TestCase):
+    """
+    Downloads of historical data
+    """
+
+    def test_rate_limit(self):
+        """
+        A rate limited download is retried
+        """
+
+        try:
+            from yfinance.exceptions import YFRateLimitError
+        except ImportError:
+            self.skipTest('yfinance has no rate limit error')
+
+        history = gen_data(12, 5)
+        ticker = mock.Mock()
+        ticker.history.side_effect = [YFRateLimitError(), history]
+        yfinance = mock.Mock()
+        yfinance.Ticker.return_value = ticker
+
+        with mock.patch.object(backtest, 'get_yfinance', return_value=yfinance), \
+                mock.patch.object(backtest.time, 'sleep') as sleep:
+            data = backtest.download_history('^GSPC', '2000-01-01', '2001-01-01')
+
+        self.assertIs(data, history)
+        self.assertEqual(ticker.history.call_count, 2)
+        sleep.assert_any_call(1)
+
+class TestResume(unittest.TestCase):
+    """
+    Runs interrupted after some trials and resumed must save the same results as full runs
+    """
+
+    data = gen_history(120, 6)
+
+    def run_full(self, output_dir, config):
+        """
+        Run a backtest without interruptions
+
+        Parameters
+        ----------
+        str output_dir: Output directory
+        BacktestConfig config: Backtest settings
+        """
+
+        random.seed(1)
+        backtester = backtest.Backtester(config, output_dir)
+        backtester.load_data(self.data)
+        backtester.run()
+
+    def run_resumed(self, output_dir, config, block):
+        """
+        Run a backtest killed while saving a block of trials, leaving a half-written row, and resume
+        it
+
+        Parameters
+        ----------
+        str output_dir: Output directory
+        BacktestConfig config: Backtest settings
+        int block: Number of the block being saved when killed, dca included
+        """
+
+        append_mapper = backtest.append_mapper
+        blocks = []
+
+        def append_killed(mapper_dir, rows):
+            blocks.append(rows)
+            if len(blocks) == block:
+                mapper_path = os.path.join(mapper_dir, 'mapper.csv')
+                with open(mapper_path, 'a', encoding='utf-8') as mapper_file:
+                    mapper_file.write('12345,1.5,"{')
+                raise KeyboardInterrupt
+            append_mapper(mapper_dir, rows)
+
+        random.seed(1)
+        backtester = backtest.Backtester(config, output_dir)
+        backtester.load_data(self.data)
+
+        with mock.patch.object(backtest, 'append_mapper', append_killed), \
+                self.assertRaises(KeyboardInterrupt):
+            backtester.run()
+
+        # trials must not depend on the random state of the resuming process
+        random.seed(2)
+        backtest.Backtester.from_checkpoint(output_dir).run()
+
+    def test_resume(self):
+        """
+        Unseeded random trials, resumed from a checkpoint saved after every block or only at the
+        start
+        """
+
+        config = backtest.BacktestConfig(trials=300, batch=True, rand_mult=True, quiet=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(backtest, 'batch_size', 50):
+            full_dir = os.path.join(tmp_dir, 'full')
+            self.run_full(full_dir, config)
+
+            for interval in (0, 3600):
+                with self.subTest(interval=interval), \
+                        mock.patch.object(backtest, 'checkpoint_interval', interval):
+                    resumed_dir = os.path.join(tmp_dir, f'resumed_{interval}')
+                    self.run_resumed(resumed_dir, config, 4)
+
+                    names = ['mapper.csv', 'best_results.csv', 'pareto_frontier.csv']
+                    self.assertEqual(read_files(full_dir, names), read_files(resumed_dir, names))
+
+class TestShards(unittest.TestCase):
+    """
+    Sharded runs merged must save the same results as a single run
+    """
+
+    def test_merge(self):
+        """
+        Seeded random trials in three shards
+        """
+
+        data = gen_history(120, 7)
+        config = backtest.BacktestConfig(
+            trials=300, batch=True, seed=1, extended_metrics=True, quiet=True
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(backtest, 'batch_size', 40):
+            full_dir = os.path.join(tmp_dir, 'full')
+            backtester = backtest.Backtester(config, full_dir)
+            backtester.load_data(data)
+            full_best = backtester.run()
+
+            shard_dirs = [os.path.join(tmp_dir, f'shard_{i}') for i in range(1, 4)]
+            for i, shard_dir in enumerate(shard_dirs, 1):
+                shard_config = dataclasses.replace(config, shard=f'{i}/3')
+                backtester = backtest.Backtester(shard_config, shard_dir)
+                backtester.load_data(data)
+                backtester.run()
+
+            merged_dir = os.path.join(tmp_dir, 'merged')
+            best = backtest.merge_shards(config, merged_dir, shard_dirs)
+
+            names = ['mapper.csv', 'best_results.csv', 'pareto_frontier.csv', 'metrics.csv']
+            self.assertEqual(read_files(full_dir, names), read_files(merged_dir, names))
+            self.assertEqual(best, full_best)
+
+class TestGrid(unittest.TestCase):
+    """
+    Grid files with invalid axes must be rejected before generating trials
+    """
+
+    def test_invalid_values(self):
+        """
+        Non-numeric and non-list axes
+        """
+
+        ranges = {tier: [-5 + i, i] for i, tier in enumerate(backtest.tiers[:-1])}
+        grids = {
+            'string': {'ranges': {**ranges, 'tier_n3': [-20, '-15']}},
+            'null': {'ranges': {**ranges, 'tier_p2': [None]}},
+            'bool': {'ranges': ranges, 'multipliers': {'tier_n3': [True, 2]}},
+            'scalar': {'ranges': ranges, 'multipliers': {'tier_p3': 0.5}},
+            'multipliers': {'ranges': ranges, 'multipliers': [1, 2]},
+            'list': [ranges]
+        }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            grid_path = os.path.join(tmp_dir, 'grid.json')
+
+            for name, grid in grids.items():
+                with self.subTest(grid=name):
+                    with open(grid_path, 'w', encoding='utf-8') as grid_file:
+                        json.dump(grid, grid_file)
+
+                    with self.assertRaisesRegex(ValueError, '^Invalid grid!'):
+                        backtest.load_grid(grid_path)
+
+            with open(grid_path, 'w', encoding='utf-8') as grid_file:
+                json.dump({'ranges': ranges, 'multipliers': {'tier_p3': [0.25, 0.5]}}, grid_file)
+
+            self.assertEqual(backtest.load_grid(grid_path)['ranges'], ranges)
+
+class TestResultsStore(unittest.TestCase):
+    """
+    Binary results must hold the same trials as mapper.csv
+    """
+
+    def test_round_trip(self):
+        """
+        Results saved as csv and binary are read back as the same rows and export to the same values
+        """
+
+        data = gen_history(120, 8)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dirs = {}
+            for results, rand_mult in itertools.product(('csv', 'binary'), (False, True)):
+                config = backtest.BacktestConfig(
+                    trials=200, batch=True, seed=1, rand_mult=rand_mult, results=results, quiet=True
+                )
+                output_dirs[results, rand_mult] = os.path.join(tmp_dir, f'{results}_{rand_mult}')
+                backtester = backtest.Backtester(config, output_dirs[results, rand_mult])
+                backtester.load_data(data)
+                backtester.run()
+
+            for rand_mult in (False, True):
+                with self.subTest(rand_mult=rand_mult):
+                    csv_dir = output_dirs['csv', rand_mult]
+                    binary_dir = output_dirs['binary', rand_mult]
+                    self.assertFalse(os.path.exists(os.path.join(binary_dir, 'mapper.csv')))
+
+                    csv_rows = [
+                        row for rows in backtest.read_results_blocks(csv_dir) for row in rows
+                    ]
+                    binary_rows = [
+                        row for rows in backtest.read_results_blocks(binary_dir) for row in rows
+                    ]
+                    self.assertEqual(len(csv_rows), 201)
+                    self.assertEqual(csv_rows, binary_rows)
+
+                    names = ['best_results.csv', 'pareto_frontier.csv']
+                    self.assertEqual(read_files(csv_dir, names), read_files(binary_dir, names))
+
+                    export_path = os.path.join(tmp_dir, f'export_{rand_mult}.csv')
+                    backtest.export_results(binary_dir, export_path)
+                    exported = pandas.read_csv(export_path)
+
+                    self.assertEqual(list(exported['Trial']), [row[0] for row in csv_rows])
+                    numpy.testing.assert_allclose(
+                        exported['Max Drawdown'], [row[5] for row in csv_rows]
+                    )
+                    self.assertTrue(numpy.isnan(exported['tier_p3 multiplier'][0]))
+                    self.assertEqual(
+                        list(exported['tier_n3 lower'][1:]),
+                        [row[7]['tier_n3'][0] for row in csv_rows[1:]]
+                    )
+                    self.assertEqual(
+                        list(exported['tier_p3 multiplier'][1:]),
+                        [row[8]['tier_p3'] for row in csv_rows[1:]]
+                    )
+
+class TestTrialCache(unittest.TestCase):
+    """
+    Trials sharing a cache key must share their results
+    """
+
+    data = gen_history(120, 9)
+    ranges = {
+        'tier_n3': [9999, -0.9], 'tier_n2': [-0.9, 1.0], 'tier_n1': [1.0, 2.4],
+        'tier_00': [2.4, 6.6], 'tier_p1': [6.6, 15.0], 'tier_p2': [15.0, 15.0],
+        'tier_p3': [15.0, 9999]
+    }
+    multipliers = {
+        'tier_n3': 1.75, 'tier_n2': 1.5, 'tier_n1': 1.5, 'tier_00': 1, 'tier_p1': 0.75,
+        'tier_p2': 0.5, 'tier_p3': 0.25
+    }
+
+    def check_equivalent(self, ranges, multipliers):
+        """
+        Compare key and results of a trial with the ones of the reference trial
+
+        Parameters
+        ----------
+        dict ranges: Trial ranges
+        dict multipliers: Trial multipliers
+        """
+
+        kernel = backtest.get_kernel(backtest.BacktestConfig(batch=True))
+
+        self.assertEqual(
+            backtest.get_trial_key(ranges, multipliers, kernel),
+            backtest.get_trial_key(self.ranges, self.multipliers, kernel)
+        )
+        self.assertEqual(
+            backtest.run_smart_dca_analysis(
+                None, 1, self.data, multipliers, ranges=ranges, save=False
+            )[1:7],
+            backtest.run_smart_dca_analysis(
+                None, 1, self.data, self.multipliers, ranges=self.ranges, save=False
+            )[1:7]
+        )
+
+    def test_empty_tier(self):
+        """
+        The multiplier of a tier without any price does not matter
+        """
+
+        self.check_equivalent(self.ranges, {**self.multipliers, 'tier_p2': 0.1})
+
+    def test_merged_tiers(self):
+        """
+        The boundary between adjacent tiers with the same multiplier does not matter
+        """
+
+        ranges = {**self.ranges, 'tier_n2': [-0.9, 1.7], 'tier_n1': [1.7, 2.4]}
+        self.check_equivalent(ranges, self.multipliers)
+
+    def test_different_trials(self):
+        """
+        Trials investing different amounts have different keys
+        """
+
+        kernel = backtest.get_kernel(backtest.BacktestConfig(batch=True))
+
+        self.assertNotEqual(
+            backtest.get_trial_key(self.ranges, {**self.multipliers, 'tier_n1': 1.25}, kernel),
+            backtest.get_trial_key(self.ranges, self.multipliers, kernel)
+        )
+
+    def test_hits(self):
+        """
+        A run served from the cache saves the same results as a run without it
+        """
+
+        config = backtest.BacktestConfig(
+            trials=200, batch=True, seed=1, extended_metrics=True, quiet=True
+        )
+        names = ['mapper.csv', 'best_results.csv', 'pareto_frontier.csv', 'metrics.csv']
+        files, counts = [], []
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i, cache_size in enumerate((0, None, None)):
+                output_dir = os.path.join(tmp_dir, str(i))
+                cache_config = dataclasses.replace(config, cache_size=cache_size)
+                backtester = backtest.Backtester(cache_config, output_dir)
+                backtester.load_data(self.data)
+                backtester.run()
+                files.append(read_files(output_dir, names))
+                counts.append(backtester.counts)
+
+        self.assertEqual(files[0], files[1])
+        self.assertEqual(files[0], files[2])
+        self.assertEqual(counts[0]['cache_hits'], 0)
+        self.assertEqual(counts[2]['cache_hits'], 200)
+
+class TestParetoFrontier(unittest.TestCase):
+    """
+    The Pareto frontier must hold exactly the trials not dominated by any other
+    """
+
+    def test_dominance(self):
+        """
+        Random trials with ties, added a block at a time after plain dca
+        """
+
+        rng = numpy.random.default_rng(10)
+        rows = [
+            [
+                trial, 0, 0, float(rng.integers(0, 20)), 0, -float(rng.integers(0, 20)),
+                int(rng.integers(0, 20)), {}, {}
+            ]
+            for trial in range(1, 1001)
+        ]
+
+        def dominates(row, other):
+            better = (row[3] >= other[3], row[5] >= other[5], row[6] <= other[6])
+            return all(better) and (row[3], row[5], row[6]) != (other[3], other[5], other[6])
+
+        expected = [row[0] for row in rows if not any(dominates(other, row) for other in rows)]
+
+        # plain dca would dominate every trial, but is never part of the frontier
+        frontier = backtest.update_pareto_frontier([], [[0, 0, 0, 100.0, 0, 0.0, 0, None, None]])
+        for start in range(0, len(rows), 300):
+            frontier = backtest.update_pareto_frontier(frontier, rows[start:start + 300])
+
+        self.assertEqual(sorted(row[0] for row in frontier), expected)
+        self.assertGreater(len(expected), 1)
+
+class TestService(unittest.TestCase):
+    """
+    Jobs sent to the backtest service
+    """
+
+    data = gen_history(120, 11)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.service = backtest.BacktestService(
+            backtest.BacktestConfig(quiet=True), self.tmp_dir.name, 1, 1
+        )
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), backtest.ServiceHandler)
+        self.server.service, self.server.verbose = self.service, False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        self.tmp_dir.cleanup()
+
+    def post(self, params):
+        """
+        Send a job to the service and return the status and body of the response
+
+        Parameters
+        ----------
+        dict params: Settings of the job
+        """
+
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{self.server.server_port}/jobs', data=json.dumps(params).encode(),
+            method='POST'
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as error:
+            return error.code, json.load(error)
+
+    def test_invalid_settings(self):
+        """
+        Jobs with unknown settings, values of the wrong type, or values not among the choices are
+        refused
+        """
+
+        invalid = [
+            {'trails': 10}, {'workers': 2}, {'trials': 'ten'}, {'stress_model': 'normal'},
+            {'results': 'parquet'}, {'save_trials': 'some'}, [1]
+        ]
+
+        for params in invalid:
+            with self.subTest(params=params):
+                status, body = self.post(params)
+                self.assertEqual(status, 400)
+                self.assertIn('Invalid', body['error'])
+
+        self.assertEqual(self.service.jobs, {})
+
+    def test_full_queue(self):
+        """
+        Jobs above the running and queued ones are refused, counting jobs still loading their data
+        """
+
+        loading = threading.Event()
+
+        def get_data(config):
+            loading.wait(60)
+            return self.data['Date'].iloc[0], self.data
+
+        self.service.get_data = get_data
+        params = {'asset': 'TEST', 'trials': 50, 'batch': True, 'seed': 1}
+        results = []
+        senders = [
+            threading.Thread(target=lambda: results.append(self.post(params))) for _ in range(2)
+        ]
+
+        for sender in senders:
+            sender.start()
+
+        deadline = time.monotonic() + 60
+        while len(self.service.jobs) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        status, body = self.post(params)
+        self.assertEqual(status, 503)
+
+        loading.set()
+        for sender in senders:
+            sender.join()
+
+        self.assertEqual(sorted(status for status, _ in results), [202, 202])
+        for _, job in results:
+            self.assertEqual(self.service.get_job(job['id'], wait=True)['status'], 'done')
+
+        self.assertEqual(self.post(params)[0], 202)
+
+    def test_data_per_asset(self):
+        """
+        Loading the data of an asset does not wait for the download of another one
+        """
+
+        downloading = threading.Event()
+
+        def get_data(config, asset, output_dir):
+            if asset == 'SLOW':
+                downloading.wait(60)
+            return self.data['Date'].iloc[0], self.data
+
+        with mock.patch.object(backtest, 'get_data', get_data):
+            slow = threading.Thread(
+                target=self.service.get_data, args=(backtest.BacktestConfig(asset='SLOW'),)
+            )
+            slow.start()
+
+            try:
+                _, data = self.service.get_data(backtest.BacktestConfig(asset='FAST'))
+                self.assertIs(data, self.data)
+                self.assertTrue(slow.is_alive())
+            finally:
+                downloading.set()
+                slow.join()
+
+class TestBacktester(unittest.TestCase):
+    """
+    Steps of a backtest run from Python
+    """
+
+    def test_run_steps(self):
+        """
+        Plain DCA and trials run on their own, results returned as records and as a frame
+        """
+
+        data = gen_history(120, 3)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = os.path.join(tmp_dir, 'run')
+            config = backtest.BacktestConfig(trials=100, batch=True, seed=1, quiet=True)
+            backtester = backtest.Backtester(config, output_dir)
+            self.assertFalse(os.path.exists(output_dir))
+
+            backtester.load_data(data)
+            dca = backtester.run_dca()
+            self.assertEqual(dca[0], 0)
+
+            best = backtester.run_trials()
+            self.assertIs(best['dca'], dca)
+
+            records = backtester.get_results_records()
+            frame = backtester.get_results_frame()
+            self.assertEqual(len(records), 101)
+            numpy.testing.assert_array_equal(records['trial'], frame['Trial'])
+            numpy.testing.assert_allclose(records['value'], frame['Value'])
+            self.assertEqual(
+                [backtest.get_record_row(record) for record in records], backtester.rows
+            )
+
+    def test_workers(self):
+        """
+        Worker processes started after the batch kernel ran in this process give the same trials
+        """
+
+        data = gen_history(120, 4)
+        rows = []
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for workers in (1, 2):
+                config = backtest.BacktestConfig(
+                    trials=400, batch=True, workers=workers, seed=1, quiet=True
+                )
+                backtester = backtest.Backtester(config, os.path.join(tmp_dir, str(workers)))
+                backtester.load_data(data)
+                backtester.run_trials()
+                rows.append(backtester.rows)
+
+        self.assertEqual(rows[0], rows[1])
+
+if __name__ == '__main__':
+    unittest.main()